@@ -1,10 +1,23 @@
 import os
+import sys
+import json
+import base64
+import csv
+import io
 import sqlite3
 import datetime
 import asyncio
 import logging
+import threading
+import queue
+import statistics
 import time
-from flask import Flask, request, render_template, jsonify, Response, send_file
+IMPORT_STARTED = time.perf_counter()  # Import-to-ready is reported once app.py has loaded
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask, request, render_template, jsonify, Response, send_file, g
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     ApplicationBuilder,
@@ -13,13 +26,19 @@ from telegram.ext import (
     CallbackQueryHandler,
     filters
 )
+from telegram.error import Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
 from telegram.request import HTTPXRequest
+from normalizer import normalize_arabic
+import migrations
+import counters
 
 # --- Configuration & Paths (Smart-Sync) ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "khatma.db")
+DB_FILE = os.environ.get("KHATMA_DB", os.path.join(BASE_DIR, "khatma.db"))
 GLOBAL_GID = 1  # Unified Global ID for Bot and Web
 TOTAL_HIZBS = 60
+# Change kinds clients can replay on their copy of /api/khatma; anything else needs a full snapshot
+DELTA_KINDS = {"assign", "return", "done", "undo", "rename", "intention_add", "intention_delete"}
 # Required for PythonAnywhere free tier, irrelevant locally
 PROXY_URL = "http://proxy.server:3128" if "PYTHONANYWHERE_DOMAIN" in os.environ else None
 
@@ -33,128 +52,503 @@ MSG_WELCOME = (
     "/hizb - معرفة أحزابك\n"
     "/done - تسجيل إتمام قراءة\n"
     "/status - حالة الختمة\n"
-    "/reset - إعادة تعيين الختمة"
+    "/reset - إعادة تعيين الختمة\n"
+    "/link - تفعيل تنبيهات الختمة في هذه المحادثة"
 )
 MSG_SELECT_HIZB = "مرحباً {name}. اختر الأحزاب التي تريد قراءتها:"
 MSG_HIZB_TAKEN = "تم اختيار الحزب {hizb} بنجاح ✅"
 MSG_RETURN_SELECT = "اختر الحزب الذي تريد إرجاعه:"
 MSG_DONE_SELECT = "اختر الحزب الذي أتممت قراءته:"
 MSG_KHATMA_COMPLETE = "🎉 **تم كمال الختمة بفضل الله** 🎉\n\nاللهم اجعل ثواب ما قرأناه نوراً على قبر والدينا."
+MSG_NOTIFY_COMPLETE = "🎉 تم كمال {name} بفضل الله، وبدأت ختمة جديدة. تقبل الله منا ومنكم."
+MSG_NOTIFY_DEADLINE = "⏰ تذكير: موعد {name} هو {deadline}، ومتبقي {remaining} من الأحزاب."
+MSG_NOTIFY_STALLED = "📌 أحزاب محجوزة منذ أكثر من {days} أيام في {name}:\n{lines}"
+MSG_LINKED = "تم ربط هذه المحادثة بـ{name} ✅ ستصلكم التنبيهات هنا."
+
+# --- Connection Pool ---
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_TIMEOUT = 20
+
+class CountingConnection(sqlite3.Connection):
+    """sqlite3 connection that counts real commits, for /api/dev/stats."""
+    commits = 0
+
+    def commit(self):
+        if self.in_transaction: CountingConnection.commits += 1
+        super().commit()
+
+class ConnectionPool:
+    """Reuses SQLite connections per process (one checked out per thread at a time).
+
+    PRAGMAs are applied once when a connection is opened, not on every use. The pool
+    remembers the pid it was created in so a gunicorn worker forked after import never
+    shares the parent's sqlite handles.
+    """
+    PRAGMAS = (
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),  # Safe with WAL, avoids an fsync per commit
+        ("busy_timeout", DB_TIMEOUT * 1000),
+        ("temp_store", "MEMORY"),
+        ("cache_size", -8000),      # ~8MB page cache per connection
+    )
+
+    def __init__(self, db_file, size=DB_POOL_SIZE, timeout=DB_TIMEOUT):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._local = threading.local()
+        self.opened = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_file, timeout=self.timeout, check_same_thread=False, factory=CountingConnection)
+        for name, value in self.PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value}")
+        self.opened += 1
+        return conn
+
+    @staticmethod
+    def _healthy(conn):
+        # Touches the C handle only (no SQL round trip); raises if the connection was closed.
+        try:
+            conn.total_changes
+        except sqlite3.ProgrammingError:
+            return False
+        if conn.in_transaction:
+            try: conn.rollback()
+            except sqlite3.Error: return False
+        return True
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid(): self._reset()  # Forked: drop the parent's handles
+            while self._idle:
+                conn = self._idle.pop()
+                if self._healthy(conn): return conn
+        return self._open()
+
+    def release(self, conn):
+        if not self._healthy(conn): return
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.size:
+                self._idle.append(conn); return
+        conn.close()
+
+    def discard(self, conn):
+        try: conn.close()
+        except sqlite3.Error: pass
+
+    @contextmanager
+    def connection(self):
+        """Yield the connection pinned to this thread, checking one out if none is.
+
+        Nested blocks reuse the outer connection, so wrapping a whole request in
+        `with db.connection():` makes every DatabaseManager call inside it share one
+        connection. Like sqlite3's own context manager, a block commits on success and
+        rolls back on error, but only if it owns the transaction: the outermost block
+        does, and so does a nested one entered with no transaction open. A nested block
+        never commits or rolls back work an enclosing block left in progress.
+        """
+        local = self._local
+        if self._pid != os.getpid(): self._reset(); local = self._local
+        conn = getattr(local, "conn", None)
+        outer = conn is None
+        if outer:
+            conn = local.conn = self.acquire()
+        owns = outer or not conn.in_transaction
+        try:
+            yield conn
+            if owns and conn.in_transaction: conn.commit()
+        except BaseException:
+            if owns:
+                try: conn.rollback()
+                except sqlite3.Error: pass
+            raise
+        finally:
+            if outer:
+                local.conn = None
+                self.release(conn)
+
+    def stats(self):
+        return {"opened": self.opened, "idle": len(self._idle), "commits": CountingConnection.commits}
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle: self.discard(conn)
+
+def encode_cursor(*key):
+    # Opaque page token for keyset pagination
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(token):
+    # A (sort value, khatma id) pair; anything else is a bad token, not a server error
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError): raise ValueError("Invalid cursor") from None
+    if not (isinstance(key, list) and len(key) == 2 and isinstance(key[1], str)
+            and isinstance(key[0], (str, int, float)) and not isinstance(key[0], bool)):
+        raise ValueError("Invalid cursor")
+    return key
+
+def search_match(query):
+    # Free text -> FTS5 query: every normalised word, as a prefix, must match
+    return " ".join(f'"{w}"*' for w in normalize_arabic(query).replace('"', " ").split())
+
+# --- Hizb Board ---
+class HizbBoard:
+    """One khatma round as two bitmasks plus a slot -> uid array.
+
+    Bit h (1..60) of `active` is set while hizb h is being read and of `completed`
+    once it is done; `owners[h]` is the uid holding it (0 = nobody). Availability
+    is a mask test and counts are popcounts. The read paths and the join keyboard
+    all work from this instead of rebuilding sets from rows.
+    """
+    __slots__ = ("active", "completed", "owners")
+    ALL = ((1 << TOTAL_HIZBS) - 1) << 1  # Bits 1..60; bit 0 unused so bit h is hizb h
+
+    def __init__(self):
+        self.active = self.completed = 0
+        self.owners = array("q", bytes(8 * (TOTAL_HIZBS + 1)))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (kind, hizb, uid) rows; kind is 'completed' or anything active."""
+        board = cls()
+        for kind, h, uid in rows: board.set(h, kind == "completed", uid)
+        return board
+
+    def set(self, h, completed, uid):
+        """Record hizb h. A number outside 1..60 is skipped (returns False); migration 12 removed the legacy ones."""
+        if not (isinstance(h, int) and 1 <= h <= TOTAL_HIZBS): return False
+        bit = 1 << h
+        if completed: self.completed |= bit; self.active &= ~bit
+        else: self.active |= bit; self.completed &= ~bit
+        self.owners[h] = uid or 0
+        return True
+
+    @property
+    def available_mask(self): return self.ALL & ~(self.active | self.completed)
+    @property
+    def active_count(self): return self.active.bit_count()
+    @property
+    def completed_count(self): return self.completed.bit_count()
+
+    def is_available(self, h): return not ((self.active | self.completed) >> h) & 1
+
+    @staticmethod
+    def hizbs(mask):
+        """Set bits of `mask` as ascending hizb numbers."""
+        out = []
+        while mask:
+            low = mask & -mask
+            out.append(low.bit_length() - 1); mask ^= low
+        return out
+
+    def available(self): return self.hizbs(self.available_mask)
+
+    def of(self, uid):
+        """A member's own hizbs, in the {"active", "completed"} shape the pages use."""
+        mine = 0
+        for h in self.hizbs(self.active | self.completed):
+            if self.owners[h] == uid: mine |= 1 << h
+        return {"active": self.hizbs(mine & self.active), "completed": self.hizbs(mine & self.completed)}
+
+    def by_owner(self):
+        """{uid: {"active": [...], "completed": [...]}} for everyone on the board, in one pass."""
+        out = {}
+        for h in self.hizbs(self.active | self.completed):
+            mine = out.setdefault(self.owners[h], {"active": [], "completed": []})
+            mine["active" if (self.active >> h) & 1 else "completed"].append(h)
+        return out
+
+    def hizb_map(self, names, unknown="Unknown"):
+        """{hizb: {status, user, uid}} for all 60 slots; `names` maps uid -> display name."""
+        out = {}
+        for h in range(1, TOTAL_HIZBS + 1):
+            bit = 1 << h
+            if not (self.active | self.completed) & bit:
+                out[h] = {"status": "available", "user": None, "uid": None}
+            else:
+                uid = self.owners[h]
+                out[h] = {"status": "active" if self.active & bit else "completed", "user": names.get(uid, unknown), "uid": uid}
+        return out
+
+# --- Khatma State Cache ---
+STATE_CACHE_ENTRIES = int(os.environ.get("STATE_CACHE_ENTRIES", 512))
+STATE_CACHE_BYTES = int(os.environ.get("STATE_CACHE_BYTES", 32 * 1024 * 1024))
+
+def _approx_size(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_approx_size(x) for x in obj)
+    elif isinstance(obj, HizbBoard):
+        size += sys.getsizeof(obj.owners)
+    return size
+
+class KhatmaStateCache:
+    """Per-process LRU of materialised khatma state, keyed by khatma_id.
+
+    An entry is only served while its version matches the khatma's current
+    `updated_at` (or `groups.last_update` for the global khatma), so a bump from
+    any worker invalidates it. Bounded by entry count and approximate bytes.
+    """
+    def __init__(self, max_entries=STATE_CACHE_ENTRIES, max_bytes=STATE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # khatma_id -> (version, state, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = 0
+
+    def get(self, khatma_id, version):
+        with self._lock:
+            entry = self._data.get(khatma_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._data.move_to_end(khatma_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, khatma_id, version, state):
+        size = _approx_size(state)
+        if size > self.max_bytes: return
+        with self._lock:
+            old = self._data.pop(khatma_id, None)
+            if old: self.bytes -= old[2]
+            self._data[khatma_id] = (version, state, size)
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def invalidate(self, khatma_id=None):
+        with self._lock:
+            if khatma_id is None:
+                self._data.clear(); self.bytes = 0
+            else:
+                old = self._data.pop(khatma_id, None)
+                if old: self.bytes -= old[2]
+
+    def stats(self):
+        return {"entries": len(self._data), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
+
+# --- Live Version Push (SSE) ---
+SSE_HEARTBEAT = int(os.environ.get("SSE_HEARTBEAT", 15))   # seconds between keep-alive comments
+SSE_MAX_AGE = int(os.environ.get("SSE_MAX_AGE", 55))       # close so proxies/workers recycle; EventSource reconnects
+SSE_REFRESH = float(os.environ.get("SSE_REFRESH", 3))      # how often a worker re-reads versions bumped by other workers
+# Each open stream holds a request thread for up to SSE_MAX_AGE, so streams need a threaded
+# worker (gunicorn.conf.py: gthread) with threads to spare; past this many, clients poll instead
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 16))
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+class VersionBroadcaster:
+    """Wakes /api/stream subscribers when a khatma version changes.
+
+    Bumps made in this worker are published directly. Bumps made by other workers
+    are picked up by re-reading the version at most once per SSE_REFRESH seconds
+    per khatma, shared by every subscriber in the process.
+    """
+    def __init__(self, fetch_version, refresh=SSE_REFRESH):
+        self.fetch_version = fetch_version
+        self.refresh = refresh
+        self._cond = threading.Condition()
+        self._versions = {}  # khatma_id -> (version, checked_at)
+
+    def publish(self, khatma_id, version):
+        with self._cond:
+            self._versions[khatma_id] = (version, time.monotonic())
+            self._cond.notify_all()
+
+    def current(self, khatma_id):
+        with self._cond:
+            cached = self._versions.get(khatma_id)
+        if cached and time.monotonic() - cached[1] < self.refresh:
+            return cached[0]
+        v = self.fetch_version(khatma_id)
+        if cached is None or v != cached[0]: self.publish(khatma_id, v)
+        else:
+            with self._cond: self._versions[khatma_id] = (v, time.monotonic())
+        return v
+
+    def wait(self, khatma_id, last_version, timeout):
+        """Return the new version once it differs from last_version, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            v = self.current(khatma_id)
+            if v != last_version: return v
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return None
+            with self._cond:
+                self._cond.wait(min(remaining, self.refresh))
+
+# --- Rollover Worker ---
+ROLLOVER_RETRY = 5        # seconds before a failed rollover is retried, doubling per failure
+ROLLOVER_RETRY_MAX = 300
+
+class RolloverWorker:
+    """Rolls finished khatmas over on a background thread, off the request path.
+
+    The request that completes the 60th hizb only queues the khatma here and
+    returns. Duplicate submissions (a double tap, another worker's recovery scan)
+    are harmless: the rollover re-checks the board inside its own BEGIN IMMEDIATE
+    transaction, so only the first one archives, counts and clears the round.
+    The thread is started lazily and, like ConnectionPool, per pid: a gunicorn
+    worker forked after import (--preload) starts its own instead of trusting the
+    parent's, which does not exist in the child.
+    """
+    def __init__(self, rollover, pending=None):
+        self.rollover = rollover
+        self.pending = pending  # Called on each (re)start to pick up rounds left complete by a dead worker
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._thread = None
+        self.queue = queue.Queue()
+        self.failures = {}  # khatma_id -> consecutive failed attempts
+        self.done = self.skipped = 0
+
+    def start(self):
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive(): return
+        with self._lock:
+            if self._pid != os.getpid(): self._reset()  # Forked: the parent's thread and queue are not ours
+            if self._thread and self._thread.is_alive(): return
+            self._thread = threading.Thread(target=self._run, name="rollover", daemon=True)
+            self._thread.start()
+
+    def submit(self, khatma_id):
+        self.start()
+        self.queue.put(khatma_id)
+
+    def _run(self):
+        if self.pending:
+            try:
+                for kid in self.pending(): self.queue.put(kid)
+            except Exception as e: print(f"⚠️ Rollover recovery scan failed: {e}")
+        while True:
+            kid = self.queue.get()
+            try:
+                if self.rollover(kid): self.done += 1
+                else: self.skipped += 1
+                self.failures.pop(kid, None)
+            except Exception as e:
+                # The round stays complete and unarchived, so try again later rather than at the next restart
+                n = self.failures[kid] = self.failures.get(kid, 0) + 1
+                delay = min(ROLLOVER_RETRY * 2 ** (n - 1), ROLLOVER_RETRY_MAX)
+                print(f"⚠️ Rollover of {kid or 'global'} failed ({e}), retrying in {delay}s")
+                retry = threading.Timer(delay, self.queue.put, (kid,))
+                retry.daemon = True; retry.start()
+
+    def stats(self):
+        return {"pending": self.queue.qsize(), "done": self.done, "skipped": self.skipped, "retrying": len(self.failures)}
 
 # --- Database Manager ---
 class DatabaseManager:
     def __init__(self, db_file):
         self.db_file = db_file
+        self.pool = ConnectionPool(db_file)
+        self.state_cache = KhatmaStateCache()
+        self.listeners = []  # Called as listener(khatma_id, version) after every bump
+        self.completion_listeners = []  # Called as listener(khatma_id) after a khatma completes
         self.init_db()
 
     def get_connection(self):
-        try:
-            conn = sqlite3.connect(self.db_file, timeout=20)
-            conn.execute("SELECT 1"); return conn
-        except: return sqlite3.connect(self.db_file, timeout=20)
+        return self.pool.connection()
+
+    def connection(self):
+        """Pin one pooled connection for the duration of a block (e.g. a whole request)."""
+        return self.pool.connection()
 
     def init_db(self):
+        # Schema lives in migrations.py; a current database costs one SELECT here
         with self.get_connection() as conn:
-            conn.execute("PRAGMA journal_mode=WAL") # Enable WAL for better concurrency
-            c = conn.cursor()
-            
-            # Migration logic moved after table creation
-            
-            # New: Khatmas table for multi-tenancy
-            c.execute('''CREATE TABLE IF NOT EXISTS khatmas (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                admin_uid INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                intention TEXT,
-                deadline TEXT,
-                total_khatmas INTEGER DEFAULT 0,
-                is_active INTEGER DEFAULT 1,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
-            
-            # Migration: Ensure updated_at exists
-            try:
-                c.execute("ALTER TABLE khatmas ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-            except: pass
-            
-            # Legacy tables (keeping for Telegram bot compatibility)
-            c.execute('CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, title TEXT, last_update REAL)')
-            
-            # Add khatma_id to existing tables - REMOVED UNIQUE from full_name to allow multi-tenant
-            c.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, full_name TEXT, username TEXT, web_pin TEXT, khatma_id TEXT)')
-            c.execute("""CREATE TABLE IF NOT EXISTS hizb_assignments (
-                group_id INTEGER, 
-                user_id INTEGER, 
-                hizb_number INTEGER, 
-                khatma_id TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (khatma_id, hizb_number)
-            )""")
-            c.execute('CREATE TABLE IF NOT EXISTS completed_hizb (id INTEGER PRIMARY KEY AUTOINCREMENT, group_id INTEGER, user_id INTEGER, hizb_number INTEGER, khatma_id TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
-            c.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT, value TEXT, khatma_id TEXT, PRIMARY KEY (key, khatma_id))')
-            c.execute('CREATE TABLE IF NOT EXISTS intentions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT, text TEXT, timestamp REAL, khatma_id TEXT)')
-            
-            # --- Migrations for existing tables ---
-            try:
-                c.execute("ALTER TABLE users ADD COLUMN khatma_id TEXT")
-            except: pass
-            
-            # RACE CONDITION FIX: Unique Index on (khatma_id, full_name)
-            # This prevents two users with same name being created in parallel.
-            try:
-                c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_khatma_user_name ON users(khatma_id, full_name)")
-            except: pass
-            
-            conn.commit()
-            try:
-                c.execute("ALTER TABLE hizb_assignments ADD COLUMN khatma_id TEXT")
-            except: pass
-            
-            try:
-                c.execute("ALTER TABLE completed_hizb ADD COLUMN khatma_id TEXT")
-            except: pass
-            
-            try:
-                c.execute("ALTER TABLE settings ADD COLUMN khatma_id TEXT")
-            except: pass
-            
-            try:
-                c.execute("ALTER TABLE intentions ADD COLUMN khatma_id TEXT")
-            except: pass
-            
-            # Missing columns for activity feed
-            try:
-                c.execute("ALTER TABLE hizb_assignments ADD COLUMN timestamp DATETIME DEFAULT CURRENT_TIMESTAMP")
-            except: pass
-            try:
-                c.execute("ALTER TABLE completed_hizb ADD COLUMN timestamp DATETIME DEFAULT CURRENT_TIMESTAMP")
-            except: pass
-            # --------------------------------------
-
-            # Migration: Ensure updated_at and last_update are numeric
-            # If they are strings (like '2026-02-03...'), reset them to current time.time()
+            self.migrated = migrations.migrate(conn)
+            self.search_enabled = bool(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'khatma_search'").fetchone())
+
+    @contextmanager
+    def changing(self, khatma_id=None):
+        """One write transaction that also versions the khatma it touches.
+
+        Yields (conn, changes). Append change dicts ({"kind", "uid", "hizb", "payload"},
+        see DELTA_KINDS) to `changes`; if any were recorded, the khatma version is bumped
+        and the changes logged inside the same transaction, so one user action is one
+        commit. Web khatmas only bump their own `khatmas.updated_at`; the legacy
+        `groups.last_update` row is only bumped for the global (Telegram) khatma.
+        """
+        v = None
+        with self.get_connection() as conn:
+            own = not conn.in_transaction  # Inside a caller's transaction, the caller commits
+            if own: conn.execute("BEGIN IMMEDIATE")
+            changes = []
             try:
-                conn.execute("UPDATE khatmas SET updated_at = ? WHERE typeof(updated_at) = 'text'", (time.time(),))
-                conn.execute("UPDATE groups SET last_update = ? WHERE typeof(last_update) = 'text'", (time.time(),))
-                conn.commit()
-            except: pass
-
-            # Initialize Global State (for Telegram bot backward compatibility)
-            c.execute("INSERT OR IGNORE INTO groups (id, title, last_update) VALUES (?, ?, ?)", (GLOBAL_GID, "Main Khatma", time.time()))
-            
-            conn.commit()
+                yield conn, changes
+                if changes: v = self._touch(conn, khatma_id, changes)
+                if own: conn.commit()
+            except BaseException:
+                if own: conn.rollback()
+                raise
+        if v is not None: self._notify(khatma_id, v)
+
+    def _touch(self, conn, khatma_id, changes):
+        v = time.time()
+        if not khatma_id:
+            conn.execute("UPDATE groups SET last_update = ? WHERE id = ?", (v, GLOBAL_GID))
+            return v
+        row = conn.execute("SELECT updated_at FROM khatmas WHERE id = ?", (khatma_id,)).fetchone()
+        if not row: return None
+        try: prev = float(row[0]) if row[0] else 0.0
+        except (ValueError, TypeError): prev = 0.0
+        conn.execute("UPDATE khatmas SET updated_at = ? WHERE id = ?", (v, khatma_id))
+        self._log_changes(conn, khatma_id, prev, v, changes)
+        return v
 
     def bump(self):
-        with self.get_connection() as conn:
-            conn.execute("UPDATE groups SET last_update = ? WHERE id = ?", (time.time(), GLOBAL_GID))
-            conn.commit()
+        """Bump the global (Telegram) khatma version."""
+        with self.changing(None) as (conn, log): log.append({"kind": "refresh"})
 
-    def bump_khatma(self, khatma_id):
+    def bump_khatma(self, khatma_id, changes=None):
+        """Bump a web khatma's version on its own, logging `changes` (default: "refresh")."""
         if not khatma_id: return
+        with self.changing(khatma_id) as (conn, log): log.extend(changes or [{"kind": "refresh"}])
+
+    def _log_changes(self, conn, khatma_id, prev_version, version, changes):
+        uids = {ch["uid"] for ch in changes if ch.get("uid") is not None}
+        names = dict(conn.execute(f"SELECT id, full_name FROM users WHERE id IN ({','.join('?' * len(uids))})", tuple(uids)).fetchall()) if uids else {}
+        # activity_events is append-only: it is also the khatma's activity history
+        conn.executemany(
+            "INSERT INTO activity_events (khatma_id, prev_version, version, kind, user_id, user_name, hizb, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(khatma_id, prev_version, version, ch["kind"], ch.get("uid"), names.get(ch.get("uid")), ch.get("hizb"),
+              json.dumps(ch["payload"], ensure_ascii=False) if ch.get("payload") else None) for ch in changes])
+
+    def get_changes(self, khatma_id, since, limit=100):
+        """Changes after version `since`, oldest first, or None if the log can't bridge the gap."""
         with self.get_connection() as conn:
-            conn.execute("UPDATE khatmas SET updated_at = ? WHERE id = ?", (time.time(), khatma_id))
-            conn.commit()
+            start = conn.execute("SELECT MIN(id) FROM activity_events WHERE khatma_id = ? AND prev_version = ?", (khatma_id, since)).fetchone()[0]
+            if start is None: return None  # A version this log never produced
+            rows = conn.execute("""SELECT id, version, kind, user_id, user_name, hizb, payload, timestamp FROM activity_events
+                                    WHERE khatma_id = ? AND id >= ? ORDER BY id LIMIT ?""", (khatma_id, start, limit + 1)).fetchall()
+        if len(rows) > limit: return None
+        changes = []
+        for event_id, v, kind, uid, name, hizb, payload, ts in rows:
+            ch = {"event_id": event_id, "version": v, "kind": kind, "uid": uid, "name": name, "hizb": hizb, "timestamp": ts}
+            if payload: ch.update(json.loads(payload))
+            changes.append(ch)
+        return changes
+
+    def _notify(self, khatma_id, version):
+        for listener in self.listeners:
+            try: listener(khatma_id, version)
+            except Exception as e: print(f"WARNING: version listener failed: {e}")
 
     def get_v(self, khatma_id=None):
         try:
@@ -175,95 +569,46 @@ class DatabaseManager:
 
     def register_user(self, user_id, full_name, username):
         with self.get_connection() as conn:
-            conn.execute("INSERT OR REPLACE INTO users (id, full_name, username) VALUES (?, ?, ?)", (user_id, full_name, username))
+            # Upsert rather than REPLACE so the member's progress counters survive
+            conn.execute("""INSERT INTO users (id, full_name, username, normalized_name) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(id) DO UPDATE SET full_name = excluded.full_name, username = excluded.username,
+                                                          normalized_name = excluded.normalized_name""",
+                         (user_id, full_name, username, normalize_arabic(full_name)))
             conn.commit()
 
-    def normalize_arabic(self, text):
-        text = text or ""
-        # Remove tashkeel
-        tashkeel = ["\u064B", "\u064C", "\u064D", "\u064E", "\u064F", "\u0650", "\u0651", "\u0652"]
-        for t in tashkeel: text = text.replace(t, "")
-        
-        # Unify Alef
-        text = text.replace("\u0622", "\u0627") # Alif Madda
-        text = text.replace("\u0623", "\u0627") # Alif Hamza Above
-        text = text.replace("\u0625", "\u0627") # Alif Hamza Below
-        
-        # Unify Ya / Alif Maqsura (End of word usually, but simple replace works for most user typos)
-        text = text.replace("\u0649", "\u064A") # Alif Maqsura -> Ya
-        
-        # Unify Taa Marbuta
-        text = text.replace("\u0629", "\u0647") # Taa Marbuta -> Ha
-        
-        # Remove invisible chars (ZWSP, LRM, RLM)
-        text = text.replace("\u200B", "").replace("\u200E", "").replace("\u200F", "")
-        
-        # Normalize spaces
-        return " ".join(text.split())
-
     def register_web_user(self, name, pin=None, khatma_id=None):
         raw_name, pin = str(name).strip(), (str(pin).strip() if pin else "")
-        norm_name = self.normalize_arabic(raw_name)
+        norm_name = normalize_arabic(raw_name)
 
         with self.get_connection() as conn:
-            # 1. Try exact match first (Performance)
-            if khatma_id:
-                query = "SELECT id, full_name, web_pin FROM users WHERE khatma_id = ?"
-                rows = conn.execute(query, (khatma_id,)).fetchall()
-            else:
-                # Global search might be expensive, but if no khatma_id, we fall back to exact match on name
-                # or we accept that global users must match exactly.
-                # Ideally we only use normalization within a specific khatma context to avoid cross-khatma collisions?
-                # For now, let's limit legacy global search to exact match to be safe, or scan all (expensive).
-                # Current usage always passes khatma_id for new web users.
-                rows = conn.execute("SELECT id, full_name, web_pin FROM users WHERE full_name = ?", (raw_name,)).fetchall()
-
-            # 2. Iterate and check normalized names
-            matched_user = None
-            for r in rows:
-                uid, db_name, db_pin = r
-                if self.normalize_arabic(db_name) == norm_name:
-                    matched_user = r
-                    break
-            
-            if matched_user:
-                uid, db_name, dbp = matched_user
-                dbp = str(dbp).strip() if dbp else ""
-                if dbp == "" or dbp == pin:
-                    if dbp == "" and pin != "": 
-                        conn.execute("UPDATE users SET web_pin = ? WHERE id = ?", (pin, int(uid)))
-                        conn.commit(); self.bump()
-                    return int(uid), "success"
-                return None, "wrong_pin"
-            else:
+            for _ in range(3):
+                # Point lookup on idx_khatma_user_norm
+                row = conn.execute("SELECT id, web_pin FROM users WHERE khatma_id IS ? AND normalized_name = ?",
+                                   (khatma_id, norm_name)).fetchone()
+                if row:
+                    uid, dbp = row
+                    dbp = str(dbp).strip() if dbp else ""
+                    if dbp == "" or dbp == pin:
+                        if dbp == "" and pin != "": 
+                            conn.execute("UPDATE users SET web_pin = ? WHERE id = ?", (pin, int(uid)))
+                            conn.commit()
+                        return int(uid), "success"
+                    return None, "wrong_pin"
+
                 # Create new
                 import random
                 wid = -int(time.time() * 1000000 + random.randint(0, 999999))
                 try:
-                    conn.execute("INSERT INTO users (id, full_name, username, web_pin, khatma_id) VALUES (?, ?, ?, ?, ?)", 
-                               (wid, raw_name, "web_user", pin if pin else None, khatma_id))
-                    conn.commit(); self.bump(); return int(wid), "success"
+                    conn.execute("INSERT INTO users (id, full_name, username, web_pin, khatma_id, normalized_name) VALUES (?, ?, ?, ?, ?, ?)", 
+                               (wid, raw_name, "web_user", pin if pin else None, khatma_id, norm_name))
+                    if khatma_id: conn.execute("UPDATE khatmas SET user_count = user_count + 1 WHERE id = ?", (khatma_id,))
+                    conn.commit()
+                    if not khatma_id: self.bump()
+                    return int(wid), "success"
                 except sqlite3.IntegrityError:
-                    # RACE CONDITION HIT or ID conflict
-                    # Check if it was the name constraint
-                    if khatma_id:
-                        existing = conn.execute("SELECT id, web_pin FROM users WHERE full_name = ? AND khatma_id = ?", (raw_name, khatma_id)).fetchone()
-                        if existing:
-                            uid, dbp = existing
-                            dbp = str(dbp).strip() if dbp else ""
-                            # Update pin if needed
-                            if dbp == "" or dbp == pin:
-                                if dbp == "" and pin != "": 
-                                    conn.execute("UPDATE users SET web_pin = ? WHERE id = ?", (pin, int(uid)))
-                                    conn.commit(); self.bump()
-                                return int(uid), "success"
-                            return None, "wrong_pin"
-                            
-                    # If not name conflict, must be ID collision - retry with new ID
-                    wid = -int(time.time() * 1000000 + random.randint(0, 999999))
-                    conn.execute("INSERT INTO users (id, full_name, username, web_pin, khatma_id) VALUES (?, ?, ?, ?, ?)", 
-                               (wid, raw_name, "web_user", pin if pin else None, khatma_id))
-                    conn.commit(); self.bump(); return int(wid), "success"
+                    # Lost a race for this name (or, rarely, the id): look it up again
+                    conn.rollback()
+            raise sqlite3.IntegrityError(f"Could not register {raw_name!r}")
 
     def is_admin(self, uid, khatma_id):
         """Check if user is admin of the specified Khatma"""
@@ -283,112 +628,133 @@ class DatabaseManager:
             row = conn.execute("SELECT web_pin FROM users WHERE id = ?", (uid,)).fetchone()
             return row and str(row[0]) == str(pin)
 
-    def assign_hizb(self, user_id, hizb_num, khatma_id=None):
-        try:
-            with self.get_connection() as conn:
-                gid = khatma_id if khatma_id else GLOBAL_GID
-                conn.execute("INSERT INTO hizb_assignments (group_id, user_id, hizb_number, khatma_id) VALUES (?, ?, ?, ?)", 
-                           (gid, int(user_id), int(hizb_num), khatma_id))
-                conn.commit(); self.bump_khatma(khatma_id); self.bump(); return True
-        except Exception as e:
-            print(f"DEBUG: assign_hizb failed: {e}")
-            return False
+    # --- Hizb State Machine ---
+    # available -> active (assign) -> completed (done); active -> available (return); completed -> active (undo).
+    # "active" rows live in hizb_assignments, "completed" rows in completed_hizb.
+    TRANSITIONS = {"assign": ("available", "active"), "return": ("active", "available"),
+                   "done": ("active", "completed"), "undo": ("completed", "active")}
+    STATE_TABLES = {"active": "hizb_assignments", "completed": "completed_hizb"}
+    # When the hizb was booked; carried along as it moves between the two tables
+    BOOKED_AT = {"active": "timestamp", "completed": "assigned_at"}
+
+    def _scope(self, khatma_id):
+        # Web khatmas are keyed by khatma_id; the global (Telegram) khatma by group_id
+        return ("khatma_id", khatma_id) if khatma_id else ("group_id", GLOBAL_GID)
+
+    def transition(self, kind, user_id, hizbs, khatma_id=None):
+        """Move `hizbs` through one state transition for `user_id`, atomically.
+
+        Runs as a single BEGIN IMMEDIATE transaction with one commit: the state check,
+        the row moves and the version bump. Returns (applied, rejected, completed)
+        where rejected hizbs were not in the required state (or belong to someone
+        else) and completed means this finished the round; completion listeners are
+        then called to roll it over.
+        """
+        src, dst = self.TRANSITIONS[kind]
+        uid = int(user_id)
+        requested = [int(h) for h in hizbs]
+        wanted = sorted({h for h in requested if 1 <= h <= TOTAL_HIZBS})
+        if not wanted: return [], requested, False
+        col, key = self._scope(khatma_id)
+        gid = khatma_id if khatma_id else GLOBAL_GID
+        completed = False
+        with self.changing(khatma_id) as (conn, log):
+            marks = ",".join("?" * len(wanted))
+            current = {h: (state, owner, booked) for state, h, owner, booked in conn.execute(f"""
+                SELECT 'active', hizb_number, user_id, timestamp FROM hizb_assignments WHERE {col} = ? AND hizb_number IN ({marks})
+                UNION ALL
+                SELECT 'completed', hizb_number, user_id, assigned_at FROM completed_hizb WHERE {col} = ? AND hizb_number IN ({marks})""",
+                (key, *wanted, key, *wanted)).fetchall()}
+            applied = [h for h in wanted if current.get(h, ("available", None))[0] == src
+                       and (src == "available" or current[h][1] == uid)]
+            if not applied: return [], requested, False
+
+            marks = ",".join("?" * len(applied))
+            if src != "available":
+                conn.execute(f"DELETE FROM {self.STATE_TABLES[src]} WHERE {col} = ? AND user_id = ? AND hizb_number IN ({marks})",
+                             (key, uid, *applied))
+            if dst != "available": # One multi-row INSERT for the whole batch
+                conn.execute(f"INSERT INTO {self.STATE_TABLES[dst]} (group_id, user_id, hizb_number, khatma_id, {self.BOOKED_AT[dst]}) VALUES "
+                             + ",".join(["(?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"] * len(applied)),
+                             [v for h in applied for v in (gid, uid, h, khatma_id, current[h][2] if h in current else None)])
+            log.extend({"kind": kind, "uid": uid, "hizb": h} for h in applied)
+            n = len(applied)
+            self._count(conn, khatma_id, uid, active=(dst == "active") * n - (src == "active") * n,
+                        completed=(dst == "completed") * n - (src == "completed") * n)
+
+            # The rollover itself runs on the RolloverWorker, after this commits
+            completed = dst == "completed" and self._completed_count(conn, khatma_id) >= TOTAL_HIZBS
+        if completed:
+            for listener in self.completion_listeners:
+                try: listener(khatma_id)
+                except Exception as e: print(f"WARNING: completion listener failed: {e}")
+        return applied, [h for h in requested if h not in applied], completed
+
+    def _completed_count(self, conn, khatma_id):
+        # Counted from the rows, not the materialised counter: a drifted counter must never
+        # archive and clear a live board. Indexed, and at most TOTAL_HIZBS rows.
+        col, key = self._scope(khatma_id)
+        return conn.execute(f"SELECT COUNT(DISTINCT hizb_number) FROM completed_hizb WHERE {col} = ? AND hizb_number BETWEEN 1 AND ?",
+                            (key, TOTAL_HIZBS)).fetchone()[0]
+
+    def _count(self, conn, khatma_id, uid, active=0, completed=0):
+        # Keep the materialised counters in step, inside the caller's transaction
+        conn.execute("UPDATE users SET active_count = active_count + ?, completed_count = completed_count + ? WHERE id = ?",
+                     (active, completed, uid))
+        if khatma_id:
+            conn.execute("UPDATE khatmas SET active_count = active_count + ?, completed_count = completed_count + ? WHERE id = ?",
+                         (active, completed, khatma_id))
+
+    def _clear_board(self, conn, khatma_id):
+        conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ?", (khatma_id,))
+        conn.execute("DELETE FROM completed_hizb WHERE khatma_id = ?", (khatma_id,))
+        conn.execute("UPDATE khatmas SET active_count = 0, completed_count = 0 WHERE id = ?", (khatma_id,))
+        conn.execute("UPDATE users SET active_count = 0, completed_count = 0 WHERE khatma_id = ?", (khatma_id,))
+
+    def assign_hizb(self, user_id, hizb, khatma_id=None):
+        return bool(self.transition("assign", user_id, [hizb], khatma_id)[0])
+
+    def assign_hizbs(self, user_id, hizbs, khatma_id=None):
+        """Book several hizbs in one transaction and one version bump. Returns (booked, failed)."""
+        valid, failed = [], []
+        for h in hizbs:
+            try: valid.append(int(h))
+            except (TypeError, ValueError): failed.append(h)
+        booked, rejected, _ = self.transition("assign", user_id, valid, khatma_id)
+        return booked, rejected + failed
 
     def unassign_hizb(self, user_id, hizb_num, khatma_id=None):
-        with self.get_connection() as conn:
-            if khatma_id:
-                c = conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ? AND user_id = ? AND hizb_number = ?", 
-                               (khatma_id, int(user_id), int(hizb_num)))
-            else:
-                c = conn.execute("DELETE FROM hizb_assignments WHERE group_id = ? AND user_id = ? AND hizb_number = ?", 
-                               (GLOBAL_GID, int(user_id), int(hizb_num)))
-            conn.commit()
-            if c.rowcount > 0: self.bump(); self.bump_khatma(khatma_id); return True
-        return False
+        return bool(self.transition("return", user_id, [hizb_num], khatma_id)[0])
 
     def mark_done(self, user_id, hizb_num, khatma_id=None):
-        with self.get_connection() as conn:
-            if khatma_id:
-                c = conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ? AND user_id = ? AND hizb_number = ?", 
-                               (khatma_id, int(user_id), int(hizb_num)))
-                if c.rowcount == 0: return False
-                gid = khatma_id if khatma_id else GLOBAL_GID
-                conn.execute("INSERT INTO completed_hizb (group_id, user_id, hizb_number, khatma_id) VALUES (?, ?, ?, ?)", 
-                           (gid, int(user_id), int(hizb_num), khatma_id))
-                conn.commit(); self.bump(); self.bump_khatma(khatma_id)
-                # Check for completion
-                comp_count = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE khatma_id = ?", (khatma_id,)).fetchone()[0]
-            else:
-                c = conn.execute("DELETE FROM hizb_assignments WHERE group_id = ? AND user_id = ? AND hizb_number = ?", 
-                               (GLOBAL_GID, int(user_id), int(hizb_num)))
-                if c.rowcount == 0: return False
-                conn.execute("INSERT INTO completed_hizb (group_id, user_id, hizb_number) VALUES (?, ?, ?)", 
-                           (GLOBAL_GID, int(user_id), int(hizb_num)))
-                conn.commit(); self.bump()
-                comp_count = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE group_id = ?", (GLOBAL_GID,)).fetchone()[0]
-            
-            return "completed" if comp_count >= 60 else True
+        """True, or "completed" if this finished the khatma (rollover queued)."""
+        applied, _, completed = self.transition("done", user_id, [hizb_num], khatma_id)
+        if completed: return "completed"
+        return bool(applied)
 
     def undo_completion(self, user_id, hizb_num, khatma_id=None):
-        try:
-            with self.get_connection() as conn:
-                # Check if actually completed by this user
-                if khatma_id:
-                    c = conn.execute("DELETE FROM completed_hizb WHERE khatma_id = ? AND user_id = ? AND hizb_number = ?", 
-                                   (khatma_id, int(user_id), int(hizb_num)))
-                else:
-                    c = conn.execute("DELETE FROM completed_hizb WHERE group_id = ? AND user_id = ? AND hizb_number = ?", 
-                                   (GLOBAL_GID, int(user_id), int(hizb_num)))
-                
-                if c.rowcount > 0:
-                    # Move back to assignments - use OR REPLACE to be safe
-                    gid = khatma_id if khatma_id else GLOBAL_GID
-                    conn.execute("INSERT OR REPLACE INTO hizb_assignments (group_id, user_id, hizb_number, khatma_id) VALUES (?, ?, ?, ?)", 
-                               (gid, int(user_id), int(hizb_num), khatma_id))
-                    conn.commit()
-                    
-                    self.bump()
-                    if khatma_id: self.bump_khatma(khatma_id)
-                    return True
-                return False
-        except Exception as e:
-            print(f"ERROR: undo_completion failed: {e}", flush=True)
-            return False
+        return bool(self.transition("undo", user_id, [hizb_num], khatma_id)[0])
 
     def mark_all_done(self, user_id, khatma_id=None):
+        """Complete all of a user's active hizbs: their numbers, or "completed" (rollover queued)."""
+        col, key = self._scope(khatma_id)
         with self.get_connection() as conn:
-            gid = khatma_id if khatma_id else GLOBAL_GID
-            if khatma_id:
-                hizbs = [r[0] for r in conn.execute("SELECT hizb_number FROM hizb_assignments WHERE khatma_id = ? AND user_id = ?", (khatma_id, int(user_id))).fetchall()]
-                if not hizbs: return []
-                conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ? AND user_id = ?", (khatma_id, int(user_id)))
-                for h in hizbs: conn.execute("INSERT INTO completed_hizb (group_id, user_id, hizb_number, khatma_id) VALUES (?, ?, ?, ?)", (gid, int(user_id), int(h), khatma_id))
-            else:
-                hizbs = [r[0] for r in conn.execute("SELECT hizb_number FROM hizb_assignments WHERE group_id = ? AND user_id = ?", (GLOBAL_GID, int(user_id))).fetchall()]
-                if not hizbs: return []
-                conn.execute("DELETE FROM hizb_assignments WHERE group_id = ? AND user_id = ?", (GLOBAL_GID, int(user_id)))
-                for h in hizbs: conn.execute("INSERT INTO completed_hizb (group_id, user_id, hizb_number) VALUES (?, ?, ?)", (GLOBAL_GID, int(user_id), int(h)))
-            conn.commit(); self.bump()
-            if khatma_id: self.bump_khatma(khatma_id)
-            
-            # Check for completion
-            if khatma_id:
-                comp_count = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE khatma_id = ?", (khatma_id,)).fetchone()[0]
-            else:
-                comp_count = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE group_id = ?", (GLOBAL_GID,)).fetchone()[0]
-            return "completed" if comp_count >= 60 else hizbs
+            hizbs = [r[0] for r in conn.execute(f"SELECT hizb_number FROM hizb_assignments WHERE {col} = ? AND user_id = ?", (key, int(user_id))).fetchall()]
+        if not hizbs: return []
+        applied, _, completed = self.transition("done", user_id, hizbs, khatma_id)
+        return "completed" if completed else applied
+
+    def get_board(self, khatma_id=None):
+        """The current round as a HizbBoard (one query)."""
+        col, key = self._scope(khatma_id)
+        with self.get_connection() as conn:
+            return HizbBoard.from_rows(conn.execute(f"""
+                SELECT 'active', hizb_number, user_id FROM hizb_assignments WHERE {col} = ?
+                UNION ALL
+                SELECT 'completed', hizb_number, user_id FROM completed_hizb WHERE {col} = ?""", (key, key)))
 
     def get_available(self, khatma_id=None):
-        with self.get_connection() as conn:
-            if khatma_id:
-                taken = {r[0] for r in conn.execute(
-                    "SELECT hizb_number FROM hizb_assignments WHERE khatma_id = ? UNION SELECT hizb_number FROM completed_hizb WHERE khatma_id = ?", 
-                    (khatma_id, khatma_id)).fetchall()}
-            else:
-                taken = {r[0] for r in conn.execute(
-                    "SELECT hizb_number FROM hizb_assignments WHERE group_id = ? UNION SELECT hizb_number FROM completed_hizb WHERE group_id = ?", 
-                    (GLOBAL_GID, GLOBAL_GID)).fetchall()}
-            return [h for h in range(1, 61) if h not in taken]
+        return self.get_board(khatma_id).available()
 
     def get_user_assignments(self, user_id, khatma_id=None):
         with self.get_connection() as conn:
@@ -410,68 +776,99 @@ class DatabaseManager:
                  return res
 
     def get_status(self, khatma_id=None):
-        with self.get_connection() as conn:
-            if khatma_id:
-                c = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE khatma_id = ?", (khatma_id,)).fetchone()[0]
-                a = conn.execute("SELECT COUNT(*) FROM hizb_assignments WHERE khatma_id = ?", (khatma_id,)).fetchone()[0]
-                rows = conn.execute(
-                    "SELECT COALESCE(u.full_name, 'مشارك'), ha.hizb_number FROM hizb_assignments ha LEFT JOIN users u ON ha.user_id = u.id WHERE ha.khatma_id = ?", 
-                    (khatma_id,)).fetchall()
-            else:
-                c = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE group_id = ?", (GLOBAL_GID,)).fetchone()[0]
-                a = conn.execute("SELECT COUNT(*) FROM hizb_assignments WHERE group_id = ?", (GLOBAL_GID,)).fetchone()[0]
-                rows = conn.execute(
-                    "SELECT COALESCE(u.full_name, 'مشارك (تليجرام)'), ha.hizb_number FROM hizb_assignments ha LEFT JOIN users u ON ha.user_id = u.id WHERE ha.group_id = ?", 
-                    (GLOBAL_GID,)).fetchall()
-            
-            ass = {}
-            for n, h in rows:
-                if n not in ass: ass[n] = []
-                ass[n].append(h)
-            return int(c), int(a), ass
+        state = self.get_khatma_state(khatma_id)
+        return state["completed_count"], state["active_count"], state["assignments"]
 
     def get_participants_activity(self, khatma_id=None):
+        return self.get_khatma_state(khatma_id)["participants"]
+
+    def get_khatma_state(self, khatma_id=None, version=None):
+        """The materialised khatma state, from the cache while its version is current. Treat as read-only."""
+        v = version if version is not None else self.get_v(khatma_id)
+        state = self.state_cache.get(khatma_id, v)
+        if state is None:
+            state = self.load_khatma_state(khatma_id)
+            self.state_cache.put(khatma_id, state["version"], state)
+        return state
+
+    def get_khatma_snapshot(self, khatma_id=None, uid=None, version=None):
+        """Everything /api/khatma needs: cached khatma state plus the caller's own hizbs."""
+        state = self.get_khatma_state(khatma_id, version)
+        mine = state["board"].of(uid) if uid is not None else {"active": [], "completed": []}
+        snap = {k: state[k] for k in (
+            "completed_count", "active_count", "remaining_count", "version", "assignments", "available_hizbs",
+            "deadline", "total_khatmas", "intentions", "participants", "intention", "khatma_name", "recent_activity")}
+        snap["my_assignments"] = list(mine["active"])
+        snap["my_completions"] = list(mine["completed"])
+        return snap
+
+    def load_khatma_state(self, khatma_id=None, activity_limit=8):
+        """Materialise a khatma from the DB inside one read transaction (4 queries)."""
         with self.get_connection() as conn:
-            # Filter by khatma_id if provided, otherwise use GLOBAL_GID for backward compatibility
-            if khatma_id:
-                # Get Active for this Khatma
-                active_rows = conn.execute(
-                    "SELECT COALESCE(u.full_name, 'مشارك'), ha.hizb_number, u.id FROM hizb_assignments ha LEFT JOIN users u ON ha.user_id = u.id WHERE ha.khatma_id = ?", 
-                    (khatma_id,)
-                ).fetchall()
-            else:
-                 # Get Active for global (backward compat)
-                active_rows = conn.execute(
-                    "SELECT COALESCE(u.full_name, 'مشارك (تليجرام)'), ha.hizb_number, u.id FROM hizb_assignments ha LEFT JOIN users u ON ha.user_id = u.id WHERE ha.group_id = ?", 
-                    (GLOBAL_GID,)
-                ).fetchall()
+            own_txn = not conn.in_transaction
+            if own_txn: conn.execute("BEGIN")  # Deferred: a consistent read snapshot under WAL
+            try:
+                if khatma_id:
+                    scope, key, default_name = "khatma_id", khatma_id, "مشارك"
+                    k = conn.execute("SELECT name, intention, deadline, total_khatmas, updated_at FROM khatmas WHERE id = ?", (khatma_id,)).fetchone()
+                    name, intention, deadline, total, v = k if k else ("Khatma", "", None, 0, None)
+                else:
+                    scope, key, default_name = "group_id", GLOBAL_GID, "مشارك (تليجرام)"
+                    deadline, total, intention, v = conn.execute("""
+                        SELECT (SELECT value FROM settings WHERE key = 'deadline'),
+                               (SELECT value FROM settings WHERE key = 'total_khatmas'),
+                               (SELECT value FROM settings WHERE key = 'intention'),
+                               (SELECT last_update FROM groups WHERE id = ?)""", (GLOBAL_GID,)).fetchone()
+                    name = "ختمة عائلة العلمي"
+                if khatma_id and not v:  # Same fallback as get_v
+                    v = conn.execute("SELECT last_update FROM groups WHERE id = ?", (GLOBAL_GID,)).fetchone()
+                    v = v[0] if v else None
+
+                # One pass over both board tables
+                rows = conn.execute(f"""
+                    SELECT 'joined', ha.hizb_number, ha.user_id, u.id, u.full_name
+                    FROM hizb_assignments ha LEFT JOIN users u ON ha.user_id = u.id WHERE ha.{scope} = ?
+                    UNION ALL
+                    SELECT 'completed', ch.hizb_number, ch.user_id, u.id, u.full_name
+                    FROM completed_hizb ch LEFT JOIN users u ON ch.user_id = u.id WHERE ch.{scope} = ?""",
+                    (key, key)).fetchall()
 
-            # Get Completed
-            if khatma_id:
-                comp_rows = conn.execute(
-                     "SELECT COALESCE(u.full_name, 'مشارك'), ch.hizb_number, u.id FROM completed_hizb ch LEFT JOIN users u ON ch.user_id = u.id WHERE ch.khatma_id = ?", 
-                     (khatma_id,)
-                ).fetchall()
+                if khatma_id:
+                    intentions = conn.execute("SELECT id, name, text, user_id FROM intentions WHERE khatma_id = ? ORDER BY id DESC LIMIT 50", (khatma_id,)).fetchall()
+                    activity = self.get_recent_activity(khatma_id, activity_limit, conn=conn)
+                else:
+                    activity = []
+                    intentions = conn.execute("SELECT id, name, text, user_id FROM intentions WHERE khatma_id IS NULL ORDER BY id DESC LIMIT 50").fetchall()
+            finally:
+                if own_txn: conn.commit()
+
+        try: v = float(v) if v else 0.0
+        except (ValueError, TypeError): v = 0.0
+
+        board = HizbBoard()
+        ass, data = {}, {}
+        for kind, h, ref_uid, user_id, full_name in rows:
+            if not board.set(h, kind == "completed", ref_uid): continue
+            pname = full_name if full_name is not None else default_name
+            entry = data.setdefault(pname, {"active": [], "completed": [], "id": user_id})
+            if user_id and not entry["id"]: entry["id"] = user_id
+            if kind == "joined":
+                ass.setdefault(pname, []).append(h)
+                entry["active"].append(h)
             else:
-                 comp_rows = conn.execute(
-                     "SELECT COALESCE(u.full_name, 'مشارك (تليجرام)'), ch.hizb_number, u.id FROM completed_hizb ch LEFT JOIN users u ON ch.user_id = u.id WHERE ch.group_id = ?", 
-                     (GLOBAL_GID,)
-                ).fetchall()
-            
-            data = {}
-            for name, hizb, uid in active_rows:
-                if name not in data: data[name] = {"active": [], "completed": [], "id": uid}
-                data[name]["active"].append(hizb)
-                if uid and not data[name].get("id"): data[name]["id"] = uid # Ensure ID is captured
-                
-            for name, hizb, uid in comp_rows:
-                if name not in data: data[name] = {"active": [], "completed": [], "id": uid}
-                data[name]["completed"].append(hizb)
-                if uid and not data[name].get("id"): data[name]["id"] = uid
-                
-            # Convert to list
-            return [{"name": k, "active": sorted(v["active"]), "completed": sorted(v["completed"]), "id": v.get("id")} for k, v in data.items()]
-
+                entry["completed"].append(h)
+
+        comp, act = board.completed_count, board.active_count
+        return {
+            "completed_count": comp, "active_count": act, "remaining_count": TOTAL_HIZBS - comp - act,
+            "version": v, "assignments": ass, "available_hizbs": board.available(),
+            "deadline": deadline, "total_khatmas": total or 0,
+            "intentions": [{"id": r[0], "name": r[1], "text": r[2], "uid": r[3]} for r in intentions],
+            "participants": [{"name": k, "active": sorted(e["active"]), "completed": sorted(e["completed"]), "id": e["id"]} for k, e in data.items()],
+            "intention": intention or "", "khatma_name": name,
+            "recent_activity": activity,
+            "board": board
+        }
 
     def get_khatma_full_details(self, khatma_id):
         with self.get_connection() as conn:
@@ -484,41 +881,13 @@ class DatabaseManager:
             admin_info = {"name": admin[0] if admin else "Unknown", "pin": admin[1] if admin else "????", "uid": k[2]}
 
             # 3. Users & Progress (Detailed)
-            # Fetch all assignments
-            assignments = conn.execute("SELECT hizb_number, user_id FROM hizb_assignments WHERE khatma_id = ?", (khatma_id,)).fetchall()
-            completed = conn.execute("SELECT hizb_number, user_id FROM completed_hizb WHERE khatma_id = ?", (khatma_id,)).fetchall()
-            
-            # Build Hizb Map
-            hizb_map = {}
-            for i in range(1, 61): hizb_map[i] = {"status": "available", "user": None, "uid": None}
-            
-            user_hizbs = {} # uid -> {active: [], completed: []}
-            
-            # Users Map
+            board = self.get_board(khatma_id)
             users_rows = conn.execute("SELECT id, full_name, web_pin FROM users WHERE khatma_id = ?", (khatma_id,)).fetchall()
-            users_dict = {r[0]: {"name": r[1], "pin": r[2]} for r in users_rows}
-            
-            for h, uid in assignments:
-                u = users_dict.get(uid)
-                hizb_map[h] = {"status": "active", "user": u["name"] if u else "Unknown", "uid": uid}
-                if uid not in user_hizbs: user_hizbs[uid] = {"active": [], "completed": []}
-                user_hizbs[uid]["active"].append(h)
-                
-            for h, uid in completed:
-                u = users_dict.get(uid)
-                hizb_map[h] = {"status": "completed", "user": u["name"] if u else "Unknown", "uid": uid}
-                if uid not in user_hizbs: user_hizbs[uid] = {"active": [], "completed": []}
-                user_hizbs[uid]["completed"].append(h)
-                
-            # Format Users List
-            users_list = []
-            for uid, info in users_dict.items():
-                uh = user_hizbs.get(uid, {"active": [], "completed": []})
-                users_list.append({
-                    "id": uid, "name": info["name"], "pin": info["pin"],
-                    "active": sorted(uh["active"]), "completed": sorted(uh["completed"])
-                })
-            
+            user_hizbs = board.by_owner()
+            users_list = [{"id": uid, "name": name, "pin": pin, **user_hizbs.get(uid, {"active": [], "completed": []})}
+                          for uid, name, pin in users_rows]
+            hizb_map = board.hizb_map({uid: name for uid, name, _ in users_rows})
+
             return {
                 "info": {"id": k[0], "name": k[1], "intention": k[3], "deadline": k[4], "total": k[5], "created": k[6]},
                 "admin": admin_info,
@@ -526,57 +895,113 @@ class DatabaseManager:
                 "hizb_map": hizb_map
             }
 
+    # --- Export ---
+    # table -> (columns, filter for one khatma). Derived data (counters, normalized
+    # names, the search index) is left out; an import rebuilds it.
+    EXPORT_COLUMNS = {
+        "khatmas": (("id", "name", "admin_uid", "intention", "deadline", "total_khatmas", "is_active", "created_at", "updated_at"), "id = ?"),
+        "settings": (("key", "value", "khatma_id"), "khatma_id = ?"),
+        "users": (("id", "full_name", "username", "web_pin", "khatma_id"), "khatma_id = ?"),
+        "hizb_assignments": (("group_id", "user_id", "hizb_number", "khatma_id", "timestamp"), "khatma_id = ?"),
+        "completed_hizb": (("group_id", "user_id", "hizb_number", "khatma_id", "timestamp", "assigned_at"), "khatma_id = ?"),
+        "intentions": (("id", "user_id", "name", "text", "timestamp", "khatma_id"), "khatma_id = ?"),
+        "khatma_rounds": (("id", "khatma_id", "round_no", "started_at", "completed_at", "readings", "participants", "duration_s", "median_read_s"), "khatma_id = ?"),
+        "round_readings": (("round_id", "hizb", "user_id", "user_name", "assigned_at", "completed_at"),
+                           "round_id IN (SELECT id FROM khatma_rounds WHERE khatma_id = ?)"),
+    }
+
+    def export_batches(self, tables, khatma_id=None, batch=1000):
+        """Yield (table, columns, rows) batches of up to `batch` rows, all from one read snapshot.
+
+        `khatma_id` None exports every khatma, the global one included. Memory stays
+        constant: rows are pulled from the cursor with fetchmany as the caller consumes them.
+        """
+        with self.get_connection() as conn:
+            own_txn = not conn.in_transaction
+            if own_txn: conn.execute("BEGIN")  # Deferred: a consistent read snapshot under WAL
+            try:
+                for table in tables:
+                    cols, where = self.EXPORT_COLUMNS[table]
+                    sql, params = f"SELECT {', '.join(cols)} FROM {table}", ()
+                    if khatma_id: sql, params = f"{sql} WHERE {where}", (khatma_id,)
+                    cur = conn.execute(sql, params)
+                    while True:
+                        rows = cur.fetchmany(batch)
+                        if not rows: break
+                        yield table, cols, rows
+            finally:
+                if own_txn: conn.commit()
+
     # --- Dev Tools ---
-    def get_all_khatmas(self, limit=20, offset=0, query="", min_progress=0, active_since=""):
-         with self.get_connection() as conn:
-            # Join with completed count for progress
+    def get_all_khatmas(self, limit=20, cursor=None, query="", min_progress=0, active_since=""):
+        """One page of khatmas. Returns (khatmas, next_cursor).
+
+        Keyset pagination: `cursor` is the opaque token from the previous page, so deep
+        pages cost the same as the first one. All filters, including min_progress, are
+        applied in SQL so pages are never short. Without `query` the order is most
+        recently active first, on (updated_at, id); with it, results come from the
+        khatma_search FTS index (names, intentions, members), best match first.
+        """
+        params = []
+        if query and self.search_enabled:
+            match = search_match(query)
+            if not match: return [], None
             sql = """
                 SELECT k.id, k.name, k.created_at, k.total_khatmas,
-                       (SELECT COUNT(*) FROM completed_hizb ch WHERE ch.khatma_id = k.id) as current_completed,
-                       (SELECT COUNT(*) FROM users u WHERE u.khatma_id = k.id) as user_count,
-                       k.updated_at
+                       k.completed_count, k.user_count, k.updated_at, hits.score
+                FROM (SELECT khatma_id, MIN(rank) AS score FROM khatma_search
+                      WHERE khatma_search MATCH ? GROUP BY khatma_id) hits
+                JOIN khatmas k ON k.id = hits.khatma_id
+                WHERE 1=1
+            """
+            params.append(match)
+            key, after, order = "(hits.score, k.id)", ">", "hits.score, k.id"
+        else:
+            sql = """
+                SELECT k.id, k.name, k.created_at, k.total_khatmas,
+                       k.completed_count, k.user_count, k.updated_at, k.updated_at
                 FROM khatmas k
                 WHERE 1=1
             """
-            params = []
-            if query:
+            key, after, order = "(k.updated_at, k.id)", "<", "k.updated_at DESC, k.id DESC"
+            if query: # No FTS5 in this SQLite build
                 sql += " AND (k.name LIKE ? OR k.id LIKE ?) "
                 params.extend([f"%{query}%", f"%{query}%"])
-            
-            if active_since:
-                 # Ensure active_since is YYYY-MM-DD format roughly
-                 sql += " AND k.updated_at >= ?"
-                 params.append(active_since)
 
-            sql += " ORDER BY k.updated_at DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
-            
+        if min_progress > 0: # int(completed / 60 * 100) >= min_progress
+            sql += " AND k.completed_count * 100 >= ?"
+            params.append(min_progress * TOTAL_HIZBS)
+
+        if active_since: # YYYY-MM-DD; updated_at is a unix timestamp
+            try: since = datetime.datetime.strptime(active_since[:10], "%Y-%m-%d").timestamp()
+            except ValueError: raise ValueError("active_since must be YYYY-MM-DD") from None
+            sql += " AND k.updated_at >= ?"
+            params.append(since)
+
+        if cursor:
+            sql += f" AND {key} {after} (?, ?)"
+            params.extend(decode_cursor(cursor))
+
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(limit + 1)
+
+        with self.get_connection() as conn:
             rows = conn.execute(sql, params).fetchall()
-            
-            # Post-filter for progress (easier in python than complex SQL subquery filter sometimes, but SQL is better. 
-            # Doing in python for simplicity of "current_completed / 60" logic)
-            results = []
-            for r in rows:
-                progress = int((r[4] / 60) * 100)
-                
-                # Format timestamps for frontend (YYYY-MM-DD HH:MM:SS)
-                created_ts = r[2]
-                updated_ts = r[6]
-                
-                # created_at is likely already a string from SQLite default, but updated_at might be float
-                # Check types and convert
-                try:
-                    if isinstance(updated_ts, (int, float)):
-                        updated_ts = datetime.datetime.fromtimestamp(updated_ts).strftime('%Y-%m-%d %H:%M:%S')
-                except: pass
-                
-                if progress >= min_progress:
-                     results.append({
-                        "id": r[0], "name": r[1], "created_at": str(created_ts), "total_khatmas": r[3], 
-                        "current_progress": r[4], "user_count": r[5], "updated_at": str(updated_ts)
-                    })
-            
-            return results
+        more, rows = len(rows) > limit, rows[:limit]
+
+        results = []
+        for r in rows:
+            # created_at is a SQLite timestamp string, updated_at a unix timestamp (the version)
+            updated_ts = r[6]
+            try:
+                if isinstance(updated_ts, (int, float)):
+                    updated_ts = datetime.datetime.fromtimestamp(updated_ts).strftime('%Y-%m-%d %H:%M:%S')
+            except: pass
+            results.append({
+                "id": r[0], "name": r[1], "created_at": str(r[2]), "total_khatmas": r[3],
+                "current_progress": r[4], "user_count": r[5], "updated_at": str(updated_ts)
+            })
+        return results, (encode_cursor(rows[-1][7], rows[-1][0]) if more else None)
 
     def get_global_stats(self):
         with self.get_connection() as conn:
@@ -593,6 +1018,10 @@ class DatabaseManager:
             conn.execute("DELETE FROM completed_hizb WHERE khatma_id = ?", (khatma_id,))
             conn.execute("DELETE FROM settings WHERE khatma_id = ?", (khatma_id,))
             conn.execute("DELETE FROM intentions WHERE khatma_id = ?", (khatma_id,))
+            conn.execute("DELETE FROM activity_events WHERE khatma_id = ?", (khatma_id,))
+            conn.execute("DELETE FROM bot_chats WHERE khatma_id = ?", (khatma_id,))
+            conn.execute("DELETE FROM round_readings WHERE round_id IN (SELECT id FROM khatma_rounds WHERE khatma_id = ?)", (khatma_id,))
+            conn.execute("DELETE FROM khatma_rounds WHERE khatma_id = ?", (khatma_id,))
             conn.commit()
             return True
 
@@ -600,33 +1029,20 @@ class DatabaseManager:
 
     def get_all_users(self, khatma_id=None):
         with self.get_connection() as conn:
-            # Get users with counts of active and completed hizbs
+            # Materialised per-member counters (see counters.py)
             # IMPORTANT: Filter by khatma_id if provided
             if khatma_id:
-                query = """
-                    SELECT u.id, u.full_name, u.web_pin,
-                           (SELECT COUNT(*) FROM hizb_assignments ha WHERE ha.user_id = u.id AND ha.khatma_id = ?) as active_count,
-                           (SELECT COUNT(*) FROM completed_hizb ch WHERE ch.user_id = u.id AND ch.khatma_id = ?) as completed_count
-                    FROM users u
-                    WHERE u.khatma_id = ?
-                """
-                rows = conn.execute(query, (khatma_id, khatma_id, khatma_id)).fetchall()
+                rows = conn.execute("SELECT id, full_name, web_pin, active_count, completed_count FROM users WHERE khatma_id = ?",
+                                    (khatma_id,)).fetchall()
             else:
-                query = """
-                    SELECT u.id, u.full_name, u.web_pin,
-                           (SELECT COUNT(*) FROM hizb_assignments ha WHERE ha.user_id = u.id) as active_count,
-                           (SELECT COUNT(*) FROM completed_hizb ch WHERE ch.user_id = u.id) as completed_count
-                    FROM users u
-                """
-                rows = conn.execute(query).fetchall()
+                rows = conn.execute("SELECT id, full_name, web_pin, active_count, completed_count FROM users").fetchall()
             return [{"id": r[0], "name": r[1], "pin": r[2], "active": r[3], "completed": r[4]} for r in rows]
 
     def reset_user_pin(self, user_id):
+        # PINs are not part of any versioned payload, so nothing is bumped
         with self.get_connection() as conn:
-            kid = conn.execute("SELECT khatma_id FROM users WHERE id = ?", (int(user_id),)).fetchone()
             conn.execute("UPDATE users SET web_pin = NULL WHERE id = ?", (int(user_id),))
-            conn.commit(); self.bump()
-            if kid and kid[0]: self.bump_khatma(kid[0])
+            conn.commit()
 
     def get_user_name(self, user_id):
         with self.get_connection() as conn:
@@ -635,91 +1051,61 @@ class DatabaseManager:
     
     def update_user_profile(self, user_id, new_name, new_pin=None):
         with self.get_connection() as conn:
-            kid = conn.execute("SELECT khatma_id FROM users WHERE id = ?", (int(user_id),)).fetchone()
+            row = conn.execute("SELECT khatma_id, full_name FROM users WHERE id = ?", (int(user_id),)).fetchone()
+        kid, old_name = row if row else (None, None)
+        with self.changing(kid) as (conn, log):
+            norm_name = normalize_arabic(new_name)
             if new_pin is not None:
-                conn.execute("UPDATE users SET full_name = ?, web_pin = ? WHERE id = ?", (new_name, new_pin, int(user_id)))
+                conn.execute("UPDATE users SET full_name = ?, normalized_name = ?, web_pin = ? WHERE id = ?", (new_name, norm_name, new_pin, int(user_id)))
             else:
-                conn.execute("UPDATE users SET full_name = ? WHERE id = ?", (new_name, int(user_id)))
-            conn.commit(); self.bump()
-            if kid and kid[0]: self.bump_khatma(kid[0])
+                conn.execute("UPDATE users SET full_name = ?, normalized_name = ? WHERE id = ?", (new_name, norm_name, int(user_id)))
+            log.append({"kind": "rename", "uid": int(user_id), "payload": {"old_name": old_name}})
 
     def get_user_hizbs(self, user_id):
         with self.get_connection() as conn:
             return [r[0] for r in conn.execute("SELECT hizb_number FROM hizb_assignments WHERE user_id = ?", (int(user_id),)).fetchall()]
 
     def increment_total_completions(self):
-        with self.get_connection() as conn:
-            curr = conn.execute("SELECT value FROM settings WHERE key = 'total_khatmas'").fetchone()
-            new_val = int(curr[0] or 0) + 1
-            conn.execute("UPDATE settings SET value = ? WHERE key = 'total_khatmas'", (str(new_val),))
-            conn.commit(); self.bump()
+        with self.changing(None) as (conn, log):
+            self._increment_total_completions(conn)
+            log.append({"kind": "refresh"})
+
+    def _increment_total_completions(self, conn):
+        curr = conn.execute("SELECT value FROM settings WHERE key = 'total_khatmas'").fetchone()
+        if not curr: return
+        new_val = int(curr[0] or 0) + 1
+        conn.execute("UPDATE settings SET value = ? WHERE key = 'total_khatmas'", (str(new_val),))
 
     def add_intention(self, uid, name, text, khatma_id=None):
-        with self.get_connection() as conn:
-            conn.execute("INSERT INTO intentions (user_id, name, text, timestamp, khatma_id) VALUES (?, ?, ?, ?, ?)", 
-                         (uid, name, text, time.time(), khatma_id))
-            conn.commit(); self.bump()
-            if khatma_id: self.bump_khatma(khatma_id)
+        with self.changing(khatma_id) as (conn, log):
+            c = conn.execute("INSERT INTO intentions (user_id, name, text, timestamp, khatma_id, normalized_text) VALUES (?, ?, ?, ?, ?, ?)",
+                         (uid, name, text, time.time(), khatma_id, normalize_arabic(text)))
+            log.append({"kind": "intention_add", "uid": uid, "payload": {"id": c.lastrowid, "name": name, "text": text}})
 
     def delete_intention(self, uid, dua_id, khatma_id=None):
         # We delete by ID andUID for security
-        with self.get_connection() as conn:
-            conn.execute("DELETE FROM intentions WHERE user_id = ? AND id = ?", (uid, int(dua_id)))
-            conn.commit(); self.bump()
-            if khatma_id: self.bump_khatma(khatma_id)
+        with self.changing(khatma_id) as (conn, log):
+            c = conn.execute("DELETE FROM intentions WHERE user_id = ? AND id = ?", (uid, int(dua_id)))
+            if c.rowcount: log.append({"kind": "intention_delete", "uid": uid, "payload": {"id": int(dua_id)}})
 
-    def get_recent_activity(self, khatma_id=None, limit=5, offset=0):
-        try:
-            with self.get_connection() as conn:
-                # Union of joined and completed events
-                sql = """
-                    SELECT 'joined' as type, u.full_name, ha.hizb_number, ha.timestamp
-                    FROM hizb_assignments ha
-                    JOIN users u ON ha.user_id = u.id
-                    WHERE ha.khatma_id = ?
-                    UNION ALL
-                    SELECT 'completed' as type, u.full_name, ch.hizb_number, ch.timestamp
-                    FROM completed_hizb ch
-                    JOIN users u ON ch.user_id = u.id
-                    WHERE ch.khatma_id = ?
-                    ORDER BY timestamp DESC
-                    LIMIT ? OFFSET ?
-                """
-                params = (khatma_id, khatma_id, limit, offset)
-                rows = conn.execute(sql, params).fetchall()
-                return [{"type": r[0], "name": r[1], "hizb": r[2], "timestamp": r[3]} for r in rows]
-        except Exception as e:
-            # If timestamp columns don't exist yet, return empty activity
-            print(f"WARNING: get_recent_activity failed (likely missing columns): {e}")
-            return []
+    # Event kinds shown in the activity feed, and the type names the page expects
+    ACTIVITY_TYPES = {"assign": "joined", "done": "completed"}
 
-    def assign_hizb(self, user_id, hizb, khatma_id=None):
-        with self.get_connection() as conn:
-            # Check availability
-            row = conn.execute("SELECT user_id FROM hizb_assignments WHERE hizb_number = ? AND khatma_id = ?", (hizb, khatma_id)).fetchone()
-            if row: return False
-            conn.execute("INSERT INTO hizb_assignments (user_id, hizb_number, khatma_id, timestamp) VALUES (?, ?, ?, datetime('now'))", (user_id, hizb, khatma_id))
-            conn.commit(); self.bump()
-            if khatma_id: self.bump_khatma(khatma_id)
-            return True
+    def get_recent_activity(self, khatma_id=None, limit=5, before_id=None, conn=None):
+        """Newest-first activity from activity_events; `before_id` is the last id already shown.
 
-    def mark_done(self, user_id, hizb, khatma_id=None):
-        with self.get_connection() as conn:
-             # Verify assignment? Not strictly needed for bot but good practice
-            conn.execute("INSERT INTO completed_hizb (user_id, hizb_number, khatma_id, timestamp) VALUES (?, ?, ?, datetime('now'))", (user_id, hizb, khatma_id))
-            conn.execute("DELETE FROM hizb_assignments WHERE hizb_number = ? AND khatma_id = ?", (hizb, khatma_id))
-            
-            # Check for khatma completion
-            count = conn.execute("SELECT COUNT(*) FROM completed_hizb WHERE khatma_id = ?", (khatma_id,)).fetchone()[0]
-            
-            completed = False
-            if count >= 60:
-                completed = True
-            
-            conn.commit(); self.bump()
-            if khatma_id: self.bump_khatma(khatma_id)
-            
-            return "completed" if completed else True
+        Walks idx_activity_khatma backwards, so any page costs the same as the first.
+        Names are the members' current names; removed members drop out of the feed.
+        """
+        if conn is None:
+            with self.get_connection() as conn:
+                return self.get_recent_activity(khatma_id, limit, before_id, conn)
+        rows = conn.execute(f"""
+            SELECT e.id, e.kind, u.full_name, e.hizb, e.timestamp
+            FROM activity_events e JOIN users u ON u.id = e.user_id
+            WHERE e.khatma_id = ? AND e.kind IN ('assign', 'done') AND e.id < ?
+            ORDER BY e.id DESC LIMIT ?""", (khatma_id, before_id or sys.maxsize, limit)).fetchall()
+        return [{"id": r[0], "type": self.ACTIVITY_TYPES[r[1]], "name": r[2], "hizb": r[3], "timestamp": r[4]} for r in rows]
 
     def get_intentions(self, khatma_id=None):
         with self.get_connection() as conn:
@@ -730,24 +1116,109 @@ class DatabaseManager:
             return [{"id": r[0], "name": r[1], "text": r[2], "uid": r[3]} for r in rows]
 
     def reset(self, khatma_id=None):
+        with self.changing(khatma_id) as (conn, log):
+            self._rollover(conn, khatma_id)
+            log.append({"kind": "refresh"})
+
+    def rollover_if_complete(self, khatma_id=None):
+        """Archive and clear a finished round. Idempotent: a no-op unless the board is still complete."""
+        with self.changing(khatma_id) as (conn, log):
+            if self._completed_count(conn, khatma_id) < TOTAL_HIZBS: return False
+            self._rollover(conn, khatma_id)
+            log.append({"kind": "refresh"})
+        return True
+
+    def pending_rollovers(self):
+        """Khatmas whose completed round was never rolled over (e.g. the worker died first).
+
+        The counter only shortlists them; rollover_if_complete re-counts the rows.
+        """
         with self.get_connection() as conn:
-            if khatma_id:
-                # Localized reset
-                conn.execute("UPDATE khatmas SET total_khatmas = total_khatmas + 1 WHERE id = ?", (khatma_id,))
-                conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ?", (khatma_id,))
-                conn.execute("DELETE FROM completed_hizb WHERE khatma_id = ?", (khatma_id,))
-                # We don't delete users or intentions for isolated Khatmas to keep membership
-                self.bump_khatma(khatma_id)
-            else:
-                self.increment_total_completions() # Increment count on reset
-                conn.execute("DELETE FROM hizb_assignments WHERE group_id = ?", (GLOBAL_GID,))
-                conn.execute("DELETE FROM completed_hizb WHERE group_id = ?", (GLOBAL_GID,))
-                conn.execute("DELETE FROM users WHERE khatma_id IS NULL") # Only clear global users
-                conn.execute("DELETE FROM intentions") 
-                # Reset deadline to 7 days from now
-                new_deadline = (datetime.datetime.now() + datetime.timedelta(days=7)).strftime("%Y-%m-%d %H:%M")
-                conn.execute("UPDATE settings SET value = ? WHERE key = 'deadline'", (new_deadline,))
-            conn.commit(); self.bump()
+            kids = [r[0] for r in conn.execute("SELECT id FROM khatmas WHERE completed_count >= ?", (TOTAL_HIZBS,))]
+            if self._completed_count(conn, None) >= TOTAL_HIZBS: kids.append(None)
+        return kids
+
+    def _archive_round(self, conn, khatma_id):
+        # Copy the round's readings into khatma_rounds / round_readings before the board is cleared,
+        # with its aggregates precomputed. Rounds are numbered from the archive: total_khatmas is admin-editable.
+        col, key = self._scope(khatma_id)
+        prev_no, prev_end = conn.execute("""SELECT MAX(round_no), MAX(completed_at) FROM khatma_rounds
+                                            WHERE COALESCE(khatma_id, '') = ?""", (khatma_id or "",)).fetchone()
+        round_id = conn.execute(f"""
+            INSERT INTO khatma_rounds (khatma_id, round_no, started_at, readings)
+            SELECT ?, ?, COALESCE(?, (SELECT created_at FROM khatmas WHERE id = ?), MIN(COALESCE(assigned_at, timestamp))), 0
+            FROM completed_hizb WHERE {col} = ?""", (khatma_id, (prev_no or 0) + 1, prev_end, khatma_id, key)).lastrowid
+        conn.execute(f"""
+            INSERT OR IGNORE INTO round_readings (round_id, hizb, user_id, user_name, assigned_at, completed_at)
+            SELECT ?, c.hizb_number, c.user_id, u.full_name, c.assigned_at, c.timestamp
+            FROM completed_hizb c LEFT JOIN users u ON u.id = c.user_id WHERE c.{col} = ?""", (round_id, key))
+        reads = [r[0] for r in conn.execute("""SELECT strftime('%s', completed_at) - strftime('%s', assigned_at)
+                                               FROM round_readings WHERE round_id = ? AND assigned_at IS NOT NULL""", (round_id,))]
+        # readings counts the archived rows, so a duplicate hizb the INSERT OR IGNORE skipped is not counted
+        conn.execute("""UPDATE khatma_rounds SET
+                            readings = (SELECT COUNT(*) FROM round_readings WHERE round_id = ?),
+                            participants = (SELECT COUNT(DISTINCT user_id) FROM round_readings WHERE round_id = ?),
+                            duration_s = strftime('%s', completed_at) - strftime('%s', started_at),
+                            median_read_s = ?
+                        WHERE id = ?""", (round_id, round_id, int(statistics.median(reads)) if reads else None, round_id))
+
+    def _rollover(self, conn, khatma_id=None):
+        # Archive the round, count it and clear the board; runs inside the caller's transaction
+        self._archive_round(conn, khatma_id)
+        if khatma_id:
+            # Localized reset
+            conn.execute("UPDATE khatmas SET total_khatmas = total_khatmas + 1 WHERE id = ?", (khatma_id,))
+            self._clear_board(conn, khatma_id)
+            # We don't delete users or intentions for isolated Khatmas to keep membership
+        else:
+            self._increment_total_completions(conn) # Increment count on reset
+            conn.execute("DELETE FROM hizb_assignments WHERE group_id = ?", (GLOBAL_GID,))
+            conn.execute("DELETE FROM completed_hizb WHERE group_id = ?", (GLOBAL_GID,))
+            conn.execute("DELETE FROM users WHERE khatma_id IS NULL") # Only clear global users
+            conn.execute("DELETE FROM intentions") 
+            # Reset deadline to 7 days from now
+            new_deadline = (datetime.datetime.now() + datetime.timedelta(days=7)).strftime("%Y-%m-%d %H:%M")
+            conn.execute("UPDATE settings SET value = ? WHERE key = 'deadline'", (new_deadline,))
+
+    # --- Round History ---
+    ROUND_FIELDS = ("round", "started_at", "completed_at", "readings", "participants", "duration_s", "median_read_s")
+
+    def get_rounds(self, khatma_id=None, limit=20, before_round=None):
+        """Archived rounds, newest first; `before_round` is the last round number already shown."""
+        with self.get_connection() as conn:
+            rows = conn.execute("""
+                SELECT round_no, started_at, completed_at, readings, participants, duration_s, median_read_s
+                FROM khatma_rounds WHERE COALESCE(khatma_id, '') = ? AND round_no < ?
+                ORDER BY round_no DESC LIMIT ?""", (khatma_id or "", before_round or sys.maxsize, limit)).fetchall()
+        return [dict(zip(self.ROUND_FIELDS, r)) for r in rows]
+
+    def get_round(self, khatma_id, round_no):
+        """One archived round with who read which hizb, or None."""
+        with self.get_connection() as conn:
+            r = conn.execute("""
+                SELECT id, round_no, started_at, completed_at, readings, participants, duration_s, median_read_s
+                FROM khatma_rounds WHERE COALESCE(khatma_id, '') = ? AND round_no = ?""", (khatma_id or "", round_no)).fetchone()
+            if not r: return None
+            readings = conn.execute("""SELECT hizb, user_id, user_name, assigned_at, completed_at
+                                       FROM round_readings WHERE round_id = ? ORDER BY hizb""", (r[0],)).fetchall()
+        out = dict(zip(self.ROUND_FIELDS, r[1:]))
+        out["readings"] = [{"hizb": h, "uid": uid, "name": name, "assigned_at": a, "completed_at": c} for h, uid, name, a, c in readings]
+        return out
+
+    def get_round_stats(self, khatma_id=None):
+        """Totals over every archived round of a khatma."""
+        with self.get_connection() as conn:
+            rounds, readings, avg_d, min_d, avg_m = conn.execute("""
+                SELECT COUNT(*), SUM(readings), AVG(duration_s), MIN(duration_s), AVG(median_read_s)
+                FROM khatma_rounds WHERE COALESCE(khatma_id, '') = ?""", (khatma_id or "",)).fetchone()
+            top = conn.execute("""
+                SELECT rr.user_id, MAX(rr.user_name), COUNT(*) FROM round_readings rr
+                JOIN khatma_rounds r ON r.id = rr.round_id WHERE COALESCE(r.khatma_id, '') = ?
+                GROUP BY rr.user_id ORDER BY COUNT(*) DESC LIMIT 5""", (khatma_id or "",)).fetchall()
+        return {"rounds": rounds, "readings": readings or 0,
+                "avg_duration_s": round(avg_d) if avg_d is not None else None, "fastest_duration_s": min_d,
+                "avg_median_read_s": round(avg_m) if avg_m is not None else None,
+                "top_readers": [{"uid": uid, "name": name, "readings": n} for uid, name, n in top]}
 
     def get_setting(self, key):
         with self.get_connection() as conn:
@@ -755,10 +1226,91 @@ class DatabaseManager:
             return row[0] if row else None
 
     def set_setting(self, key, value):
-        with self.get_connection() as conn:
+        # Settings rows are the global khatma's configuration
+        with self.changing(None) as (conn, log):
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-            conn.commit(); self.bump()
+            log.append({"kind": "refresh"})
     
+    # --- Telegram Chat Links ---
+    def link_chat(self, chat_id, khatma_id=None):
+        """Subscribe a chat to a khatma's notifications (None = the global khatma)."""
+        with self.get_connection() as conn:
+            if khatma_id and not conn.execute("SELECT 1 FROM khatmas WHERE id = ?", (khatma_id,)).fetchone():
+                return False
+            conn.execute("INSERT OR REPLACE INTO bot_chats (chat_id, khatma_id) VALUES (?, ?)", (chat_id, khatma_id))
+            conn.commit()
+            return True
+
+    def unlink_chat(self, chat_id):
+        with self.get_connection() as conn:
+            conn.execute("DELETE FROM bot_chats WHERE chat_id = ?", (chat_id,))
+            conn.commit()
+
+    def linked_chats(self, khatma_id=None):
+        """(khatma name, [chat_id]) for a khatma's linked chats; the name is None for the global khatma."""
+        with self.get_connection() as conn:
+            chats = [r[0] for r in conn.execute("SELECT chat_id FROM bot_chats WHERE khatma_id IS ?", (khatma_id,))]
+            name = None
+            if khatma_id and chats:
+                row = conn.execute("SELECT name FROM khatmas WHERE id = ?", (khatma_id,)).fetchone()
+                name = row[0] if row else None
+            return name, chats
+
+    def claim_notification(self, key):
+        """True for one caller at a time, across workers, until the message is sent.
+
+        A claim that was neither marked sent nor released within NOTIFY_CLAIM_TTL (its
+        worker died holding it) can be taken over.
+        """
+        now = time.time()
+        with self.get_connection() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO notification_log (key, claimed_at, sent_at) VALUES (?, ?, NULL)", (key, now))
+            if not cur.rowcount:
+                cur = conn.execute("""UPDATE notification_log SET claimed_at = ?
+                                      WHERE key = ? AND sent_at IS NULL AND claimed_at < ?""", (now, key, now - NOTIFY_CLAIM_TTL))
+            conn.commit()
+            return cur.rowcount == 1
+
+    def notification_sent(self, key):
+        with self.get_connection() as conn:
+            conn.execute("UPDATE notification_log SET sent_at = CURRENT_TIMESTAMP WHERE key = ?", (key,))
+            conn.commit()
+
+    def release_notification(self, key):
+        """Give up a claim whose send failed, so the next sweep tries again."""
+        with self.get_connection() as conn:
+            conn.execute("DELETE FROM notification_log WHERE key = ? AND sent_at IS NULL", (key,))
+            conn.commit()
+
+    def due_deadlines(self, hours):
+        """Linked khatmas whose deadline falls within the next `hours`: [(khatma_id, name, deadline, remaining)]."""
+        now = datetime.datetime.now()
+        lo, hi = now.strftime("%Y-%m-%d %H:%M"), (now + datetime.timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M")
+        with self.get_connection() as conn:
+            due = conn.execute(f"""SELECT id, name, deadline, {TOTAL_HIZBS} - completed_count FROM khatmas
+                                   WHERE deadline > ? AND deadline <= ? AND id IN (SELECT khatma_id FROM bot_chats)""",
+                               (lo, hi)).fetchall()
+            if conn.execute("SELECT 1 FROM bot_chats WHERE khatma_id IS NULL LIMIT 1").fetchone():
+                deadline, done = conn.execute("""SELECT (SELECT value FROM settings WHERE key = 'deadline'),
+                                                        (SELECT COUNT(*) FROM completed_hizb WHERE group_id = ?)""",
+                                              (GLOBAL_GID,)).fetchone()
+                if deadline and lo < deadline <= hi: due.append((None, None, deadline, TOTAL_HIZBS - done))
+            return due
+
+    def stalled_hizbs(self, days):
+        """Hizbs of linked khatmas held longer than `days`: {khatma_id: [(hizb, reader name)]}."""
+        with self.get_connection() as conn:
+            rows = conn.execute("""SELECT a.khatma_id, a.hizb_number, u.full_name FROM hizb_assignments a
+                                   LEFT JOIN users u ON u.id = a.user_id
+                                   WHERE a.timestamp < datetime('now', ?)
+                                     AND (a.khatma_id IN (SELECT khatma_id FROM bot_chats)
+                                          OR (a.khatma_id IS NULL AND a.group_id = ?
+                                              AND EXISTS (SELECT 1 FROM bot_chats WHERE khatma_id IS NULL)))
+                                   ORDER BY a.khatma_id, a.hizb_number""", (f"-{int(days)} days", GLOBAL_GID)).fetchall()
+        stalled = {}
+        for kid, h, name in rows: stalled.setdefault(kid, []).append((h, name))
+        return stalled
+
     # --- Multi-Tenant Khatma Functions ---
     def generate_khatma_id(self):
         import random, string
@@ -778,16 +1330,17 @@ class DatabaseManager:
             if admin_name and admin_pin:
                 # Create admin user
                 admin_uid = -int(time.time())
-                conn.execute("INSERT INTO users (id, full_name, username, web_pin, khatma_id) VALUES (?, ?, ?, ?, ?)",
-                            (admin_uid, admin_name, "web_admin", admin_pin, khatma_id))
+                conn.execute("INSERT INTO users (id, full_name, username, web_pin, khatma_id, normalized_name) VALUES (?, ?, ?, ?, ?, ?)",
+                            (admin_uid, admin_name, "web_admin", admin_pin, khatma_id, normalize_arabic(admin_name)))
             
-            # Create khatma
-            conn.execute("""INSERT INTO khatmas (id, name, admin_uid, intention, deadline, total_khatmas) 
-                           VALUES (?, ?, ?, ?, ?, 0)""",
-                        (khatma_id, name, admin_uid, intention, deadline))
+            # Create khatma (numeric version from the start; nothing else to bump)
+            conn.execute("""INSERT INTO khatmas (id, name, admin_uid, intention, deadline, total_khatmas, updated_at, user_count,
+                                                 normalized_name, normalized_intention)
+                           VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)""",
+                        (khatma_id, name, admin_uid, intention, deadline, time.time(), 1 if admin_uid else 0,
+                         normalize_arabic(name), normalize_arabic(intention)))
             
             conn.commit()
-            self.bump()
         
         return khatma_id, admin_uid
     
@@ -802,14 +1355,15 @@ class DatabaseManager:
         return None
 
     def update_khatma(self, khatma_id, **kwargs):
-        with self.get_connection() as conn:
+        with self.changing(khatma_id) as (conn, log):
             if 'intention' in kwargs:
-                conn.execute("UPDATE khatmas SET intention = ? WHERE id = ?", (kwargs['intention'], khatma_id))
+                conn.execute("UPDATE khatmas SET intention = ?, normalized_intention = ? WHERE id = ?",
+                             (kwargs['intention'], normalize_arabic(kwargs['intention']), khatma_id))
             if 'deadline' in kwargs:
                 conn.execute("UPDATE khatmas SET deadline = ? WHERE id = ?", (kwargs['deadline'], khatma_id))
             if 'total_khatmas' in kwargs:
                 conn.execute("UPDATE khatmas SET total_khatmas = ? WHERE id = ?", (kwargs['total_khatmas'], khatma_id))
-            conn.commit(); self.bump(); self.bump_khatma(khatma_id)
+            log.append({"kind": "refresh"})
             return True
 
     def update_user_pin(self, uid, new_pin, khatma_id):
@@ -819,18 +1373,35 @@ class DatabaseManager:
             return True
 
     def remove_user_from_khatma(self, uid, khatma_id):
-        with self.get_connection() as conn:
-            conn.execute("DELETE FROM users WHERE id = ? AND khatma_id = ?", (uid, khatma_id))
+        with self.changing(khatma_id) as (conn, log):
+            row = conn.execute("SELECT active_count, completed_count FROM users WHERE id = ? AND khatma_id = ?", (uid, khatma_id)).fetchone()
+            if row:
+                conn.execute("DELETE FROM users WHERE id = ? AND khatma_id = ?", (uid, khatma_id))
+                conn.execute("UPDATE khatmas SET user_count = user_count - 1, active_count = active_count - ?, completed_count = completed_count - ? WHERE id = ?",
+                             (row[0], row[1], khatma_id))
             conn.execute("DELETE FROM hizb_assignments WHERE user_id = ? AND khatma_id = ?", (uid, khatma_id))
             conn.execute("DELETE FROM completed_hizb WHERE user_id = ? AND khatma_id = ?", (uid, khatma_id))
-            conn.commit(); self.bump(); self.bump_khatma(khatma_id)
+            log.append({"kind": "refresh"})
             return True
 
 
 # --- Bot Handlers ---
 db = DatabaseManager(DB_FILE)
+broadcaster = VersionBroadcaster(db.get_v)
+db.listeners.append(broadcaster.publish)
+rollovers = RolloverWorker(db.rollover_if_complete, db.pending_rollovers)
+db.completion_listeners.append(rollovers.submit)
 TOKEN = os.environ.get("BOT_TOKEN", "8587551117:AAHnsUgMSeqlYRMcRnu4JJkSjC3Lb8cRaGI")
 
+# Handlers run concurrently on the bot loop; their SQLite work runs on a small pool
+BOT_CONCURRENT_UPDATES = 16
+BOT_MAX_PENDING = 500
+db_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bot-db")
+
+async def run_db(fn, *args):
+    """Run a blocking DatabaseManager call on the DB pool, off the bot loop."""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
 # Only initialize Telegram bot if token is provided
 if TOKEN:
     req_kwargs = {"read_timeout": 60, "connect_timeout": 60}
@@ -845,84 +1416,240 @@ if TOKEN:
             del req_kwargs["proxy_url"]
         req_conf = HTTPXRequest(**req_kwargs)
         print("⚠️ Warning: HTTPXRequest rejected proxy_url. Chat bot might not work on PA.")
-    application = ApplicationBuilder().token(TOKEN).request(req_conf).build()
+    application = ApplicationBuilder().token(TOKEN).request(req_conf).concurrent_updates(BOT_CONCURRENT_UPDATES).build()
 else:
     application = None
     print("⚠️  No BOT_TOKEN found - Telegram bot disabled (web-only mode)")
 
 async def start(u, c):
-    db.register_user(u.effective_user.id, u.effective_user.full_name, u.effective_user.username)
+    await run_db(db.register_user, u.effective_user.id, u.effective_user.full_name, u.effective_user.username)
     await u.message.reply_text(MSG_WELCOME, parse_mode="Markdown")
 
+# --- Telegram Notifications ---
+NOTIFY_RATE = 20               # messages per second across all chats (Telegram allows about 30)
+NOTIFY_RETRIES = 3
+NOTIFY_MAX_PENDING = 5000
+NOTIFY_SWEEP = 600             # seconds between deadline / stalled-hizb sweeps
+DEADLINE_REMIND_HOURS = 24
+STALL_DAYS = 3
+NOTIFY_CLAIM_TTL = 3600        # seconds before an unsent claim from a dead worker may be retaken
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.stamp = burst, time.monotonic()
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate); self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1; return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class Notifier:
+    """Outgoing Telegram broadcasts, queued and sent by one task on the bot loop.
+
+    Producers (request threads, bot handlers, the sweep) only enqueue, so they
+    never wait on Telegram. Sends are paced by a token bucket; flood-control
+    replies pause the sender, network errors are retried with backoff, and chats
+    that removed the bot are unlinked. The reminder sweep runs on a thread of its
+    own, started per pid like RolloverWorker, so it does not wait for bot traffic;
+    it starts the bot loop only when it has something to send.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.queue = asyncio.Queue(NOTIFY_MAX_PENDING)  # Only touched from the bot loop
+        self.bucket = TokenBucket(NOTIFY_RATE, NOTIFY_RATE)
+        self.sent = self.failed = self.dropped = 0
+        self._sweeper, self._sweep_pid = None, None
+        self._lock = threading.Lock()
+
+    def _put(self, chat_id, text, attempt=0, key=None):
+        try: self.queue.put_nowait((chat_id, text, attempt, key))
+        except asyncio.QueueFull:
+            self.dropped += 1; self._release(key)
+
+    def _release(self, key):
+        if key: asyncio.ensure_future(run_db(db.release_notification, key))
+
+    def post(self, khatma_id, text, key=None, **fmt):
+        """Queue a broadcast from any thread.
+
+        With a `key` each chat gets the message once: the claim is per chat, marked sent
+        only after Telegram accepted it and released if the send fails. Nothing starts the
+        bot loop unless a chat is linked to the khatma.
+        """
+        name, chats = db.linked_chats(khatma_id)
+        if key: chats = [(c, f"{key}:{c}") for c in chats if db.claim_notification(f"{key}:{c}")]
+        else: chats = [(c, None) for c in chats]
+        if not chats: return
+        msg = text.format(name=name or "الختمة", **fmt)
+        loop = ensure_bot_started()
+        for chat_id, ckey in chats: loop.call_soon_threadsafe(self._put, chat_id, msg, 0, ckey)
+
+    def khatma_completed(self, khatma_id):
+        """Completion listener; called from whichever thread committed the last hizb."""
+        self.post(khatma_id, MSG_NOTIFY_COMPLETE)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id, text, attempt, key = await self.queue.get()
+            await self.bucket.take()
+            try:
+                await self.bot.send_message(chat_id, text)
+                self.sent += 1
+                if key: await run_db(db.notification_sent, key)
+            except RetryAfter as e: # Flood control applies to the whole bot, so pause the sender
+                wait = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else e.retry_after
+                await asyncio.sleep(wait); self._put(chat_id, text, attempt, key)
+            except Forbidden: # Bot was removed from the chat
+                await run_db(db.unlink_chat, chat_id); self._release(key)
+            except (TimedOut, NetworkError) as e:
+                if attempt + 1 >= NOTIFY_RETRIES:
+                    self.failed += 1; self._release(key); print(f"⚠️ Notification to {chat_id} dropped: {e}")
+                else: loop.call_later(2 ** attempt, self._put, chat_id, text, attempt + 1, key)
+            except TelegramError as e:
+                self.failed += 1; self._release(key); print(f"⚠️ Notification to {chat_id} failed: {e}")
+
+    def start_sweep(self):
+        if self._sweep_pid == os.getpid() and self._sweeper.is_alive(): return
+        with self._lock:
+            if self._sweep_pid == os.getpid() and self._sweeper.is_alive(): return
+            self._sweep_pid = os.getpid()  # A forked worker starts its own; the parent's thread is not in the child
+            self._sweeper = threading.Thread(target=self.sweep, name="notify-sweep", daemon=True)
+            self._sweeper.start()
+
+    def sweep(self):
+        """Periodically queue deadline reminders and stalled-hizb nudges for linked chats."""
+        while True:
+            try:
+                for kid, name, deadline, remaining in db.due_deadlines(DEADLINE_REMIND_HOURS):
+                    if remaining > 0:
+                        self.post(kid, MSG_NOTIFY_DEADLINE, key=f"deadline:{kid or ''}:{deadline}", deadline=deadline, remaining=remaining)
+                today = datetime.date.today().isoformat()
+                for kid, rows in db.stalled_hizbs(STALL_DAYS).items():
+                    lines = "\n".join(f"• {h}: {who or '؟'}" for h, who in rows)
+                    self.post(kid, MSG_NOTIFY_STALLED, key=f"stalled:{kid or ''}:{today}", days=STALL_DAYS, lines=lines)
+            except Exception as e:
+                print(f"⚠️ Notification sweep failed: {e}")
+            time.sleep(NOTIFY_SWEEP)
+
+    def stats(self):
+        return {"pending": self.queue.qsize(), "sent": self.sent, "failed": self.failed, "dropped": self.dropped}
+
+notifier = Notifier(application.bot) if application else None
+if notifier: db.completion_listeners.append(notifier.khatma_completed)
+
+# --- Join Keyboard ---
+KEYBOARD_COALESCE = 0.5   # seconds a tap waits so a burst of taps on one message becomes one edit
+KEYBOARD_MESSAGES = 256   # join messages whose last-sent keyboard is remembered
+
+class JoinKeyboards:
+    """The 60-button join keyboard, rebuilt only when the global khatma version moves.
+
+    Only touched from the bot loop, so no locking. Each join message remembers the
+    availability it last showed; an edit is skipped when nothing visible changed,
+    and taps arriving while an edit is pending for the same message ride on it.
+    """
+    def __init__(self):
+        self._built = (None, None, None)  # (version, HizbBoard.available_mask, markup)
+        self._shown = OrderedDict()       # (chat_id, message_id) -> available_mask
+        self._pending = set()
+
+    async def get(self):
+        v = await run_db(db.get_v)
+        if self._built[0] != v:
+            board = await run_db(db.get_board)
+            avail = board.available_mask
+            markup = self._built[2] if avail == self._built[1] else self._build(board)
+            self._built = (v, avail, markup)
+        return self._built[1], self._built[2]
+
+    @staticmethod
+    def _build(board):
+        kb = []; row = []
+        for h in range(1, 61):
+            txt, cb = (str(h), f"assign_{h}") if board.is_available(h) else ("✖️", "ignore")
+            row.append(InlineKeyboardButton(txt, callback_data=cb))
+            if len(row) == 8: kb.append(row); row = []
+        if row: kb.append(row)
+        return InlineKeyboardMarkup(kb)
+
+    def shown(self, message, avail):
+        key = (message.chat_id, message.message_id)
+        self._shown[key] = avail; self._shown.move_to_end(key)
+        while len(self._shown) > KEYBOARD_MESSAGES: self._shown.popitem(last=False)
+
+    async def refresh(self, q):
+        key = (q.message.chat_id, q.message.message_id)
+        if key in self._pending: return
+        self._pending.add(key)
+        try: await asyncio.sleep(KEYBOARD_COALESCE)
+        finally: self._pending.discard(key)
+        avail, markup = await self.get()
+        if self._shown.get(key) == avail: return
+        self.shown(q.message, avail)
+        try: await q.edit_message_reply_markup(reply_markup=markup)
+        except TelegramError: self._shown.pop(key, None)
+
+join_keyboards = JoinKeyboards()
+
 async def join_khatma(u, c):
-    avail = db.get_available()
+    avail, markup = await join_keyboards.get()
     if not avail: return await u.message.reply_text("عذراً، لا توجد أحزاب متاحة.")
-    kb = []; row = []
-    for h in range(1, 61):
-        txt, cb = (str(h), f"assign_{h}") if h in avail else ("✖️", "ignore")
-        row.append(InlineKeyboardButton(txt, callback_data=cb))
-        if len(row) == 8: kb.append(row); row = []
-    if row: kb.append(row)
-    await u.message.reply_text(MSG_SELECT_HIZB.format(name=u.effective_user.full_name), reply_markup=InlineKeyboardMarkup(kb))
+    msg = await u.message.reply_text(MSG_SELECT_HIZB.format(name=u.effective_user.full_name), reply_markup=markup)
+    join_keyboards.shown(msg, avail)
 
 async def callback_handler(u, c):
     q = u.callback_query; await q.answer()
     if q.data.startswith("assign_"):
         h = int(q.data.split("_")[1])
         # Force register user so /status can find their name
-        db.register_user(u.effective_user.id, u.effective_user.full_name, u.effective_user.username)
-        if db.assign_hizb(u.effective_user.id, h):
+        await run_db(db.register_user, u.effective_user.id, u.effective_user.full_name, u.effective_user.username)
+        if await run_db(db.assign_hizb, u.effective_user.id, h):
             await c.bot.send_message(u.effective_chat.id, MSG_HIZB_TAKEN.format(hizb=h))
-            # Update keyboard
-            avail = db.get_available(); kb = []; row = []
-            for i in range(1, 61):
-                txt, d = (str(i), f"assign_{i}") if i in avail else ("✖️", "ignore")
-                row.append(InlineKeyboardButton(txt, callback_data=d))
-                if len(row) == 8: kb.append(row); row = []
-            if row: kb.append(row)
-            try: await q.edit_message_reply_markup(reply_markup=InlineKeyboardMarkup(kb))
-            except: pass
+            await join_keyboards.refresh(q)
     elif q.data.startswith("unassign_"):
         h = int(q.data.split("_")[1])
-        if db.unassign_hizb(u.effective_user.id, h):
+        if await run_db(db.unassign_hizb, u.effective_user.id, h):
             await q.edit_message_text(f"تم إرجاع الحزب {h} بنجاح.")
     elif q.data == "done_all":
-        res = db.mark_all_done(u.effective_user.id)
+        res = await run_db(db.mark_all_done, u.effective_user.id)
         if res == "completed":
             await q.edit_message_text(MSG_KHATMA_COMPLETE, parse_mode="Markdown")
-            db.reset()
         elif res:
             await q.edit_message_text(f"تقبل الله منك، تم إتمام الأحزاب: {', '.join(str(x) for x in res)}")
     elif q.data.startswith("done_"):
         h = int(q.data.split("_")[1])
-        res = db.mark_done(u.effective_user.id, h)
+        res = await run_db(db.mark_done, u.effective_user.id, h)
         if res == "completed":
             await q.edit_message_text(MSG_KHATMA_COMPLETE, parse_mode="Markdown")
-            db.reset()
         elif res:
             await q.edit_message_text(f"تقبل الله منك، تم إتمام الحزب {h}.")
     elif q.data == "confirm_reset":
-        db.reset(); await q.edit_message_text("تمت إعادة تعيين الختمة بنجاح ✅")
+        await run_db(db.reset); await q.edit_message_text("تمت إعادة تعيين الختمة بنجاح ✅")
 
 async def my_hizb(u, c):
-    h = db.get_user_assignments(u.effective_user.id)
+    h = await run_db(db.get_user_assignments, u.effective_user.id)
     await u.message.reply_text(f"أحزابك الحالية: {', '.join(str(x) for x in h)}" if h else "ليس لديك أحزاب محجوزة.")
 
 async def return_hizb(u, c):
-    h = db.get_user_assignments(u.effective_user.id)
+    h = await run_db(db.get_user_assignments, u.effective_user.id)
     if not h: return await u.message.reply_text("ليس لديك أحزاب لإرجاعها.")
     kb = [[InlineKeyboardButton(f"إلغاء حجز حزب {x}", callback_data=f"unassign_{x}")] for x in h]
     await u.message.reply_text(MSG_RETURN_SELECT, reply_markup=InlineKeyboardMarkup(kb))
 
 async def done_hizb(u, c):
-    h = db.get_user_assignments(u.effective_user.id)
+    h = await run_db(db.get_user_assignments, u.effective_user.id)
     if not h: return await u.message.reply_text("ليس لديك أحزاب مخصصة.")
     kb = [[InlineKeyboardButton(f"إتمام حزب {x}", callback_data=f"done_{x}")] for x in h]
     if len(h) > 1: kb.append([InlineKeyboardButton("✅ إتمام الكل", callback_data="done_all")])
     await u.message.reply_text(MSG_DONE_SELECT, reply_markup=InlineKeyboardMarkup(kb))
 
 async def status(u, c):
-    comp, act, ass = db.get_status()
+    comp, act, ass = await run_db(db.get_status)
     msg = f"📊 المكتملة: {comp} | ⏳ قيد القراءة: {act}\n📌 متبقي: {60-comp-act}\n👤 القراء:\n"
     for n, x in ass.items(): msg += f"• {n}: {', '.join(str(i) for i in x)}\n"
     await u.message.reply_text(msg if ass else "لا يوجد قراء حالياً.")
@@ -938,18 +1665,35 @@ async def set_deadline_cmd(u, c):
     if member.status not in ['administrator', 'creator']: return await u.message.reply_text("عذراً، للمشرفين فقط.")
     
     if not c.args:
-        curr = db.get_setting("deadline")
+        curr = await run_db(db.get_setting, "deadline")
         return await u.message.reply_text(f"الرجاء تحديد التاريخ. حالياً: `{curr}`\nمثال: `/deadline 2026-02-01`", parse_mode="Markdown")
     
     new_date = c.args[0]
     # Simple validation YYYY-MM-DD
     try:
         datetime.datetime.strptime(new_date, "%Y-%m-%d")
-        db.set_setting("deadline", f"{new_date} 23:59")
+        await run_db(db.set_setting, "deadline", f"{new_date} 23:59")
         await u.message.reply_text(f"تم تحديث موعد الختمة إلى: `{new_date}` ✅", parse_mode="Markdown")
     except:
         await u.message.reply_text("صيغة التاريخ غير صحيحة. استخدم: YYYY-MM-DD")
 
+async def link_chat_cmd(u, c):
+    if u.effective_chat.type != "private":
+        member = await c.bot.get_chat_member(u.effective_chat.id, u.effective_user.id)
+        if member.status not in ['administrator', 'creator']: return await u.message.reply_text("عذراً، للمشرفين فقط.")
+    kid = c.args[0].strip().lower() if c.args else None  # No argument links the global khatma
+    if not await run_db(db.link_chat, u.effective_chat.id, kid):
+        return await u.message.reply_text("لم يتم العثور على الختمة. مثال: `/link abc123`", parse_mode="Markdown")
+    k = await run_db(db.get_khatma, kid) if kid else None
+    await u.message.reply_text(MSG_LINKED.format(name=k["name"] if k else "الختمة"))
+
+async def unlink_chat_cmd(u, c):
+    if u.effective_chat.type != "private":
+        member = await c.bot.get_chat_member(u.effective_chat.id, u.effective_user.id)
+        if member.status not in ['administrator', 'creator']: return await u.message.reply_text("عذراً، للمشرفين فقط.")
+    await run_db(db.unlink_chat, u.effective_chat.id)
+    await u.message.reply_text("تم إيقاف التنبيهات في هذه المحادثة.")
+
 async def keyword_handler(u, c):
     t = (u.message.text or "").strip()
     if any(k in t for k in ["ختمة", "بداية", "مساعدة"]): await start(u, c)
@@ -962,6 +1706,28 @@ async def keyword_handler(u, c):
 # --- Flask & Webhooks ---
 app = Flask(__name__)
 
+# Background threads start per worker, not at import (see RolloverWorker): from gunicorn's
+# post_worker_init hook, or failing that with the first request the worker serves
+@app.before_request
+def start_background():
+    rollovers.start()
+    if notifier: notifier.start_sweep()
+
+# Every DatabaseManager call made while handling a request shares one pooled connection
+@app.before_request
+def pin_db_connection():
+    g.db_ctx = db.connection()
+    g.db_ctx.__enter__()
+
+@app.teardown_request
+def release_db_connection(exc):
+    ctx = g.pop("db_ctx", None)
+    if ctx is None: return
+    if exc is None: ctx.__exit__(None, None, None)
+    else:
+        try: ctx.__exit__(type(exc), exc, exc.__traceback__)
+        except Exception: pass
+
 # Only register bot handlers if bot is initialized
 if application:
     application.add_handler(CommandHandler(["start", "help"], start))
@@ -972,6 +1738,8 @@ if application:
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("reset", reset))
     application.add_handler(CommandHandler("deadline", set_deadline_cmd))
+    application.add_handler(CommandHandler("link", link_chat_cmd))
+    application.add_handler(CommandHandler("unlink", unlink_chat_cmd))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, keyword_handler))
     application.add_handler(CallbackQueryHandler(callback_handler))
 
@@ -1045,24 +1813,41 @@ def developer_dashboard():
 @app.route("/api/dev/stats")
 @require_dev_auth
 def dev_stats():
-    return jsonify(db.get_global_stats())
+    stats = db.get_global_stats()
+    stats["state_cache"] = db.state_cache.stats()  # This worker only
+    stats["db_pool"] = db.pool.stats()
+    stats["worker"] = {"pid": os.getpid(), "startup_ms": STARTUP_MS, "bot_started": bot_started}
+    stats["rollovers"] = rollovers.stats()
+    if notifier: stats["notifications"] = notifier.stats()
+    return jsonify(stats)
+
+@app.route("/api/dev/counters", methods=["GET", "POST"])
+@require_dev_auth
+def dev_counters():
+    # GET reports drift of the materialised counters; POST recomputes them from the rows
+    with db.get_connection() as conn:
+        if request.method == "GET":
+            return jsonify({"drift": counters.drift(conn)})
+        conn.execute("BEGIN IMMEDIATE")
+        return jsonify({"repaired": counters.repair(conn)})
 
 @app.route("/api/dev/khatmas")
 @require_dev_auth
 
 def dev_khatmas():
-    page = int(request.args.get("page", 1))
-    limit = int(request.args.get("limit", 20))
-    query = request.args.get("q", "").strip()
-    min_progress = int(request.args.get("min_progress", 0))
-    active_since = request.args.get("active_since", "").strip()
-    
-    offset = (page - 1) * limit
-    
-    khatmas = db.get_all_khatmas(limit=limit, offset=offset, query=query, min_progress=min_progress, active_since=active_since)
+    try:
+        limit = max(1, min(int(request.args.get("limit", 20)), 100))
+        khatmas, next_cursor = db.get_all_khatmas(
+            limit=limit,
+            cursor=request.args.get("cursor") or None,
+            query=request.args.get("q", "").strip(),
+            min_progress=int(request.args.get("min_progress") or 0),
+            active_since=request.args.get("active_since", "").strip())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({
         "khatmas": khatmas,
-        "page": page,
+        "next_cursor": next_cursor,
         "limit": limit
     })
 
@@ -1077,6 +1862,50 @@ def dev_khatma_details():
     
     return jsonify(details)
 
+# Export groups, in dependency order (an import replays them as they come)
+EXPORT_SETS = {
+    "khatmas": ("khatmas", "settings"), "users": ("users",), "assignments": ("hizb_assignments",),
+    "completions": ("completed_hizb",), "intentions": ("intentions",), "history": ("khatma_rounds", "round_readings"),
+}
+
+@app.route("/api/dev/export")
+@require_dev_auth
+def dev_export():
+    """Stream a backup: NDJSON for any of EXPORT_SETS (`tables`), or CSV for one table.
+
+    NDJSON lines are {"table": ..., <columns>}, after a leading {"table": "_meta"} line.
+    Without khatma_id every khatma is exported; import_ndjson.py restores the NDJSON.
+    """
+    khatma_id = request.args.get("khatma_id") or None
+    fmt = request.args.get("format", "ndjson")
+    stamp = f"khatma-{khatma_id or 'all'}-{datetime.date.today().isoformat()}"
+    if fmt == "csv":
+        table = request.args.get("table", "")
+        if table not in db.EXPORT_COLUMNS:
+            return jsonify({"error": f"table must be one of {', '.join(db.EXPORT_COLUMNS)}"}), 400
+        def lines():
+            buf = io.StringIO(); out = csv.writer(buf)
+            out.writerow(db.EXPORT_COLUMNS[table][0])
+            for _, _, rows in db.export_batches([table], khatma_id):
+                out.writerows(rows)
+                yield buf.getvalue(); buf.seek(0); buf.truncate()
+            yield buf.getvalue()
+        return Response(lines(), mimetype="text/csv",
+                        headers={"Content-Disposition": f"attachment; filename={stamp}-{table}.csv"})
+    if fmt != "ndjson": return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    names = [n for n in request.args.get("tables", ",".join(EXPORT_SETS)).split(",") if n]
+    if any(n not in EXPORT_SETS for n in names):
+        return jsonify({"error": f"tables must be among {', '.join(EXPORT_SETS)}"}), 400
+    tables = [t for n in EXPORT_SETS if n in names for t in EXPORT_SETS[n]]
+    def lines():
+        yield json.dumps({"table": "_meta", "schema": migrations.LATEST, "khatma_id": khatma_id,
+                          "exported_at": datetime.datetime.now().isoformat(timespec="seconds")}) + "\n"
+        for table, cols, rows in db.export_batches(tables, khatma_id):
+            yield "".join(json.dumps({"table": table, **dict(zip(cols, r))}, ensure_ascii=False) + "\n" for r in rows)
+    return Response(lines(), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": f"attachment; filename={stamp}.ndjson"})
+
 @app.route("/api/dev/khatma/remove_user", methods=["POST"])
 @require_dev_auth
 def dev_remove_user():
@@ -1094,11 +1923,9 @@ def dev_reset_khatma():
     kid = d.get("khatma_id")
     if not kid: return jsonify({"error": "Missing ID"}), 400
     
-    with db.get_connection() as conn:
-        conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ?", (kid,))
-        conn.execute("DELETE FROM completed_hizb WHERE khatma_id = ?", (kid,))
-        conn.commit()
-    db.bump(); db.bump_khatma(kid)
+    with db.changing(kid) as (conn, log):
+        db._clear_board(conn, kid)
+        log.append({"kind": "refresh"})
     return jsonify({"success": True})
 
 @app.route("/api/dev/khatma/delete", methods=["POST"])
@@ -1191,28 +2018,14 @@ def admin_control():
     elif action == "assign":
         if db.assign_hizb(uid, hizb, khatma_id): return jsonify({"success": True})
     elif action == "assign_bulk":
-        hizbs = d.get("hizbs", [])
-        for h in hizbs:
-            db.assign_hizb(uid, h, khatma_id)
-        return jsonify({"success": True})
+        booked, failed = db.assign_hizbs(uid, d.get("hizbs", []), khatma_id)
+        return jsonify({"success": True, "booked": booked, "failed": failed})
     elif action == "update_pin":
         pin = d.get("pin")
         if db.update_user_pin(uid, pin, khatma_id): return jsonify({"success": True})
     elif action == "complete":
         res = db.mark_done(uid, hizb, khatma_id)
-        if res == "completed": 
-            # Reset specifically for this Khatma? Or currently reset() is global?
-            # db.reset() is GLOBAL and dangerous.
-            # TODO: Implement khatma-specific reset. For now, mark done loop handles it?
-            # mark_done returns 'completed' but doesn't auto-reset the DB for multi-tenant yet?
-            # Actually db.reset() clears global tables.
-            # For multi-tenant, we should implement a per-Khatma reset or just increment counter.
-            if khatma_id:
-                # Custom logic for web khatma completion: increment counter, maybe clear assignments?
-                # Currently just returning success.
-                pass 
-            else:
-                db.reset() # Global bot reset
+        if res == "completed": # The rollover worker archives and clears the round
             return jsonify({"success": True, "completed": True})
         if res: return jsonify({"success": True})
     elif action == "reset_pin":
@@ -1333,13 +2146,52 @@ def delete_khatma_user():
         import traceback; traceback.print_exc()
         return jsonify({"error": f"Delete Error: {str(e)}"}), 500
 
+# --- Telegram Bot Runner ---
+# Updates are processed on one long-lived event loop in a daemon thread. The
+# webhook only parses the update, hands it to PTB's update queue and returns 200;
+# PTB runs up to BOT_CONCURRENT_UPDATES handlers at once on that loop. The bot is
+# started on the first webhook rather than at import, so a reloaded worker can
+# serve web requests without waiting on Telegram's API.
+bot_loop = None
+bot_started = False
+bot_start_lock = threading.Lock()
+
+async def _start_bot():
+    global bot_started
+    delay = 1
+    while True:
+        started = time.perf_counter()
+        try:
+            await application.initialize(); await application.start()
+            break
+        except Exception as e:
+            # Updates stay queued; webhook() sheds load once BOT_MAX_PENDING is reached
+            print(f"⚠️ Telegram bot start failed ({e}), retrying in {delay}s")
+            await asyncio.sleep(delay); delay = min(delay * 2, 60)
+    bot_started = True
+    asyncio.create_task(notifier.run())
+    print(f"🤖 Telegram bot started in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+def ensure_bot_started():
+    """Start the bot's loop thread once per worker and return the loop."""
+    global bot_loop
+    if bot_loop: return bot_loop
+    with bot_start_lock:
+        if bot_loop: return bot_loop
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="telegram-bot", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(_start_bot(), loop)
+        bot_loop = loop
+    return bot_loop
+
 @app.route(f"/{TOKEN}", methods=["POST"])
 def webhook():
-    async def process():
-        up = Update.de_json(request.get_json(force=True), application.bot)
-        await application.process_update(up)
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(process())
+    if not application: return "Bot disabled", 404
+    loop = ensure_bot_started()
+    # Telegram redelivers on non-2xx, so a backed-up queue pushes back instead of growing
+    if application.update_queue.qsize() >= BOT_MAX_PENDING: return "Busy", 503
+    up = Update.de_json(request.get_json(force=True), application.bot)
+    loop.call_soon_threadsafe(application.update_queue.put_nowait, up)
     return "OK", 200
 
 @app.route("/")
@@ -1395,6 +2247,16 @@ def sitemap():
 </urlset>""".format(date=datetime.date.today().isoformat())
     return Response(xml, mimetype="application/xml")
 
+def conditional_json(etag, build):
+    """Strong-ETag conditional GET: answer 304 without calling build() when the client's copy is current."""
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"  # Browsers must revalidate, but may reuse the body on 304
+    return resp
+
 @app.route("/api/khatma")
 def api_status():
     try:
@@ -1405,57 +2267,110 @@ def api_status():
         # Stick to integer for UID
         uid = int(ur) if (ur and (ur.isdigit() or (ur.startswith('-') and ur[1:].isdigit()))) else None
         
-        # Get data - pass khatma_id if provided
-        c, a, ass = db.get_status(khatma_id)
+        # One read transaction instead of a dozen separate calls; nothing at all when unchanged
         v = db.get_v(khatma_id)
-        avail = db.get_available(khatma_id)
-        my_ass = db.get_user_assignments(uid, khatma_id) if uid else []
-        my_comp = db.get_user_completions(uid, khatma_id) if uid else []
-        
-        # Get khatma-specific settings or default
-        if khatma_id:
-            khatma = db.get_khatma(khatma_id)
-            deadline = khatma['deadline'] if khatma else None
-            total = khatma['total_khatmas'] if khatma else 0
-            intention = khatma['intention'] if khatma else ""
-            khatma_name = khatma['name'] if khatma else "Khatma"
-        else:
-            deadline = db.get_setting("deadline")
-            total = db.get_setting("total_khatmas")
-            intention = db.get_setting("intention") or ""
-            khatma_name = "ختمة عائلة العلمي"
-        
-        intentions = db.get_intentions(khatma_id)
-        parts = db.get_participants_activity(khatma_id) if khatma_id else db.get_participants_activity()
-        recent_activity = db.get_recent_activity(khatma_id, limit=8)
-
-        return jsonify({
-            "completed_count": int(c), "active_count": int(a), "remaining_count": 60-int(c)-int(a),
-            "version": v or 0, "assignments": ass, "available_hizbs": avail, 
-            "my_assignments": my_ass, "my_completions": my_comp,
-            "deadline": deadline, "total_khatmas": total or 0, "intentions": intentions,
-            "participants": parts, "intention": intention, "khatma_name": khatma_name,
-            "recent_activity": recent_activity
-        })
+        return conditional_json(f"k{v}-u{uid}", lambda: db.get_khatma_snapshot(khatma_id, uid, version=v))
     except Exception as e:
         import traceback; traceback.print_exc()
         print(f"DEBUG: api_status failed: {e}")
         return jsonify({"error": f"Status Error: {str(e)}"}), 500
 
+@app.route("/api/khatma/changes")
+def api_changes():
+    """Delta sync: the change-log entries after `since`, or a full snapshot when they can't be replayed."""
+    try:
+        ur = request.args.get("uid")
+        khatma_id = request.args.get("khatma_id")
+        if not khatma_id: khatma_id = None
+        uid = int(ur) if (ur and (ur.isdigit() or (ur.startswith('-') and ur[1:].isdigit()))) else None
+        try: since = float(request.args.get("since", ""))
+        except ValueError: since = None
+
+        v = db.get_v(khatma_id)
+        if since is not None and since == v:
+            return jsonify({"version": v, "changes": []})
+        changes = db.get_changes(khatma_id, since) if (khatma_id and since is not None) else None
+        if changes is None or any(ch["kind"] not in DELTA_KINDS for ch in changes):
+            snap = db.get_khatma_snapshot(khatma_id, uid)
+            return jsonify({"version": snap["version"], "full": True, "status": snap})
+        return jsonify({"version": changes[-1]["version"], "changes": changes})
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({"error": f"Changes Error: {str(e)}"}), 500
+
 @app.route("/api/activity")
 def api_activity():
     khatma_id = request.args.get("khatma_id")
     if not khatma_id:
         return jsonify({"error": "khatma_id required"}), 400
     try:
-        offset = int(request.args.get("offset", 0))
-        limit  = int(request.args.get("limit", 10))
+        before_id = int(request.args.get("before_id") or 0) or None
+        limit = max(1, min(int(request.args.get("limit", 10)), 100))
+    except ValueError:
+        return jsonify({"error": "before_id and limit must be integers"}), 400
+    def page():
         # Fetch one extra to know if there are more pages
-        items = db.get_recent_activity(khatma_id, limit=limit + 1, offset=offset)
-        has_more = len(items) > limit
-        return jsonify({"items": items[:limit], "has_more": has_more, "next_offset": offset + limit})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        items = db.get_recent_activity(khatma_id, limit=limit + 1, before_id=before_id)
+        more, items = len(items) > limit, items[:limit]
+        return {"items": items, "has_more": more, "next_before_id": items[-1]["id"] if more else None}
+    return conditional_json(f"a{db.get_v(khatma_id)}-{before_id}-{limit}", page)
+
+@app.route("/api/rounds")
+def api_rounds():
+    """Archived rounds, newest first; the first page also carries the khatma's totals."""
+    khatma_id = request.args.get("khatma_id") or None
+    try:
+        before_round = int(request.args.get("before_round") or 0) or None
+        limit = max(1, min(int(request.args.get("limit", 20)), 100))
+    except ValueError:
+        return jsonify({"error": "before_round and limit must be integers"}), 400
+    def page():
+        rounds = db.get_rounds(khatma_id, limit + 1, before_round)
+        more, rounds = len(rounds) > limit, rounds[:limit]
+        out = {"rounds": rounds, "has_more": more, "next_before_round": rounds[-1]["round"] if more else None}
+        if not before_round: out["stats"] = db.get_round_stats(khatma_id)
+        return out
+    # Rounds are only archived by a rollover, which bumps the version
+    return conditional_json(f"r{db.get_v(khatma_id)}-{before_round}-{limit}", page)
+
+@app.route("/api/round")
+def api_round():
+    khatma_id = request.args.get("khatma_id") or None
+    try: round_no = int(request.args.get("round", ""))
+    except ValueError: return jsonify({"error": "round required"}), 400
+    r = db.get_round(khatma_id, round_no)
+    if not r: return jsonify({"error": "Round not found"}), 404
+    return jsonify(r)
+
+@app.route("/api/stream")
+def api_stream():
+    """Server-Sent Events: pushes {"version": v} whenever the khatma changes.
+
+    Streams are closed after SSE_MAX_AGE seconds; EventSource reconnects by itself.
+    Clients without EventSource keep polling /api/check_update, and so do clients
+    turned away with a 204 once SSE_MAX_STREAMS streams are open in this worker.
+    """
+    khatma_id = request.args.get("khatma_id")
+    if not khatma_id: khatma_id = None
+    if not sse_slots.acquire(blocking=False): return "", 204  # EventSource stops reconnecting on 204
+
+    def events():
+        yield "retry: 3000\n\n"
+        v = broadcaster.current(khatma_id)
+        yield f"event: version\ndata: {json.dumps({'version': v})}\n\n"
+        stop_at = time.monotonic() + SSE_MAX_AGE
+        while time.monotonic() < stop_at:
+            nv = broadcaster.wait(khatma_id, v, min(SSE_HEARTBEAT, max(0, stop_at - time.monotonic())))
+            if nv is None:
+                yield ": ping\n\n"
+                continue
+            v = nv
+            yield f"event: version\ndata: {json.dumps({'version': v})}\n\n"
+
+    resp = Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    resp.call_on_close(sse_slots.release)  # Also runs when the client is gone before the first event
+    return resp
 
 @app.route("/api/check_update")
 def check_update(): 
@@ -1463,7 +2378,7 @@ def check_update():
     if not khatma_id: khatma_id = None
     v = db.get_v(khatma_id)
     # print(f"CHECK UPDATE: khatma={khatma_id} v={v}", flush=True)
-    return jsonify({"version": v})
+    return conditional_json(f"v{v}", lambda: {"version": v})
 
 
 @app.route("/api/login", methods=["POST"])
@@ -1536,17 +2451,7 @@ def api_join_batch():
         uid, s = db.register_web_user(name, pin, khatma_id)
         if s == "wrong_pin": return jsonify({"error": "الرمز السري غير صحيح"}), 403
 
-        booked = []
-        failed = []
-        for h in hizbs:
-            try:
-                if db.assign_hizb(uid, int(h), khatma_id):
-                    booked.append(int(h))
-                else:
-                    failed.append(int(h))
-            except:
-                failed.append(int(h))
-
+        booked, failed = db.assign_hizbs(uid, hizbs, khatma_id)
         if booked:
             return jsonify({"success": True, "uid": uid, "booked": booked, "failed": failed})
         else:
@@ -1566,21 +2471,7 @@ def api_done():
     if uid is None: return jsonify({"error": "User not identified"}), 400
     
     res = db.mark_done(uid, int(d.get("hizb")), khatma_id)
-    if res == "completed":
-        # Auto-increment total for this khatma and reset
-        if khatma_id:
-            khatma = db.get_khatma(khatma_id)
-            if khatma:
-                new_total = khatma['total_khatmas'] + 1
-                with db.get_connection() as conn:
-                    conn.execute("UPDATE khatmas SET total_khatmas = ? WHERE id = ?", (new_total, khatma_id))
-                    # Reset assignments/completed for this khatma
-                    conn.execute("DELETE FROM hizb_assignments WHERE khatma_id = ?", (khatma_id,))
-                    conn.execute("DELETE FROM completed_hizb WHERE khatma_id = ?", (khatma_id,))
-                    conn.commit()
-                    db.bump()
-        else:
-            db.reset()  # Legacy bot behavior
+    if res == "completed": # Rollover is queued; clients pick up the fresh board from its version bump
         return jsonify({"success": True, "completed": True})
     if res: return jsonify({"success": True})
     return jsonify({"error": "فشل"}), 400
@@ -1594,7 +2485,6 @@ def api_done_all():
     
     res = db.mark_all_done(uid, khatma_id)
     if res == "completed":
-        db.reset(khatma_id)
         return jsonify({"success": True, "completed": True})
     if res: return jsonify({"success": True})
     return jsonify({"error": "لا يوجد أحزاب لإتمامها"}), 400
@@ -1647,11 +2537,6 @@ def api_return():
         return jsonify({"error": str(e)}), 500
 
 
-# Only initialize bot on startup if it exists
-if application:
-    async def init_b(): await application.initialize(); await application.start()
-    loop = asyncio.get_event_loop(); loop.run_until_complete(init_b())
-
 @app.route("/api/download_card", methods=["POST"])
 def download_card():
     try:
@@ -1709,5 +2594,9 @@ def download_card():
         traceback.print_exc()
         return jsonify({"success": False, "error": str(e)}), 500
 
+STARTUP_MS = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+print(f"🚀 Ready in {STARTUP_MS} ms (pid {os.getpid()}, schema v{migrations.LATEST}"
+      + (f", applied migrations {db.migrated})" if db.migrated else ", no schema work)"))
+
 if __name__ == "__main__": 
     app.run(port=5000, debug=True)
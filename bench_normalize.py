@@ -0,0 +1,53 @@
+"""Micro-benchmark: shared translate-table normaliser vs the old str.replace chain.
+
+Usage: python bench_normalize.py [names]
+"""
+import random
+import sys
+import time
+
+from normalizer import _normalize, normalize_arabic
+
+
+def legacy_normalize_arabic(text):
+    # The per-call str.replace implementation this module replaced
+    text = text or ""
+    tashkeel = ["\u064B", "\u064C", "\u064D", "\u064E", "\u064F", "\u0650", "\u0651", "\u0652"]
+    for t in tashkeel: text = text.replace(t, "")
+    text = text.replace("\u0622", "\u0627")
+    text = text.replace("\u0623", "\u0627")
+    text = text.replace("\u0625", "\u0627")
+    text = text.replace("\u0649", "\u064A")
+    text = text.replace("\u0629", "\u0647")
+    text = text.replace("\u200B", "").replace("\u200E", "").replace("\u200F", "")
+    return " ".join(text.split())
+
+
+def make_names(n, seed=7):
+    rnd = random.Random(seed)
+    first = ["أحمد", "محمد", "فاطمة", "عائشة", "إبراهيم", "مُصْطَفَى", "آمنة", "ليلى", "يحيى", "خديجة"]
+    last = ["الحسن", "العلي", "بن يوسف", "الأنصاري", "عبد الله", "الزهراء"]
+    return [f"{rnd.choice(first)} {rnd.choice(last)} {i}" for i in range(n)]
+
+
+def bench(label, fn, names, rounds=5):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for name in names: fn(name)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {len(names) / best / 1e6:7.2f} M names/s")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    names = make_names(n)
+    mismatches = sum(legacy_normalize_arabic(s) != normalize_arabic(s) for s in names)
+    print(f"{n} names, {mismatches} differ from the legacy output")
+
+    bench("legacy str.replace", legacy_normalize_arabic, names)
+    bench("translate (no cache)", _normalize.__wrapped__, names)
+    _normalize.cache_clear()
+    bench("translate + lru (cold)", normalize_arabic, names, rounds=1)
+    hot = names[:500]  # A khatma's worth of members, normalised on every login
+    bench("translate + lru (hot)", normalize_arabic, hot * 200)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Consistency check / repair for the materialised progress counters.
+
+khatmas.active_count / completed_count / user_count and users.active_count /
+completed_count are maintained by the app's mutation paths in the same
+transaction as the rows they count. Anything that edits the tables behind the
+app's back (fix_duplicates.py, manual SQL) can make them drift; this recomputes
+them from the rows.
+
+Usage:
+    python3 counters.py [path/to/khatma.db]            # report drift
+    python3 counters.py [path/to/khatma.db] --repair   # and fix it
+"""
+import sqlite3
+import sys
+
+GLOBAL_GID = 1
+
+# Actual counts, from the rows. Web members are scoped by khatma_id, Telegram
+# (global) members by group_id, the same way the board queries scope them.
+_KHATMA_ACTUAL = """
+    SELECT k.id, k.active_count, k.completed_count, k.user_count,
+           (SELECT COUNT(*) FROM hizb_assignments WHERE khatma_id = k.id),
+           (SELECT COUNT(*) FROM completed_hizb WHERE khatma_id = k.id),
+           (SELECT COUNT(*) FROM users WHERE khatma_id = k.id)
+    FROM khatmas k"""
+_USER_ACTUAL = f"""
+    SELECT u.id, u.active_count, u.completed_count,
+           CASE WHEN u.khatma_id IS NULL
+                THEN (SELECT COUNT(*) FROM hizb_assignments WHERE group_id = {GLOBAL_GID} AND user_id = u.id)
+                ELSE (SELECT COUNT(*) FROM hizb_assignments WHERE khatma_id = u.khatma_id AND user_id = u.id) END,
+           CASE WHEN u.khatma_id IS NULL
+                THEN (SELECT COUNT(*) FROM completed_hizb WHERE group_id = {GLOBAL_GID} AND user_id = u.id)
+                ELSE (SELECT COUNT(*) FROM completed_hizb WHERE khatma_id = u.khatma_id AND user_id = u.id) END
+    FROM users u"""
+
+
+def drift(conn):
+    """Rows whose stored counters differ from the actual counts."""
+    out = []
+    for kid, a, c, n, real_a, real_c, real_n in conn.execute(_KHATMA_ACTUAL):
+        if (a, c, n) != (real_a, real_c, real_n):
+            out.append({"table": "khatmas", "id": kid, "stored": [a, c, n], "actual": [real_a, real_c, real_n]})
+    for uid, a, c, real_a, real_c in conn.execute(_USER_ACTUAL):
+        if (a, c) != (real_a, real_c):
+            out.append({"table": "users", "id": uid, "stored": [a, c], "actual": [real_a, real_c]})
+    return out
+
+
+def repair(conn):
+    """Recompute every counter from the rows. Returns the drift that was fixed."""
+    fixed = drift(conn)
+    for d in fixed:
+        if d["table"] == "khatmas":
+            conn.execute("UPDATE khatmas SET active_count = ?, completed_count = ?, user_count = ? WHERE id = ?", (*d["actual"], d["id"]))
+        else:
+            conn.execute("UPDATE users SET active_count = ?, completed_count = ? WHERE id = ?", (*d["actual"], d["id"]))
+    return fixed
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    path = args[0] if args else "khatma.db"
+    conn = sqlite3.connect(path)
+    rows = repair(conn) if "--repair" in sys.argv else drift(conn)
+    for d in rows:
+        print(f"  {d['table']} {d['id']}: stored {d['stored']} actual {d['actual']}")
+    conn.commit()
+    conn.close()
+    if not rows: print("✅ Counters are consistent.")
+    else: print(f"{'🔧 Repaired' if '--repair' in sys.argv else '⚠️  Found'} {len(rows)} drifted rows.")
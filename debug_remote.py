@@ -1,33 +1,12 @@
 import requests
 import json
 
+from normalizer import normalize_arabic
+
 BASE_URL = "https://khatma.pythonanywhere.com"
 DEV_KEY = "CCkr_gYmyKBUup2gqKWMskJ1h8bVc9l4"
 KHATMA_ID = "iwu8zv"
 
-def normalize_arabic(text):
-    text = text or ""
-    # Remove tashkeel
-    tashkeel = ["\u064B", "\u064C", "\u064D", "\u064E", "\u064F", "\u0650", "\u0651", "\u0652"]
-    for t in tashkeel: text = text.replace(t, "")
-    
-    # Unify Alef
-    text = text.replace("\u0622", "\u0627") # Alif Madda
-    text = text.replace("\u0623", "\u0627") # Alif Hamza Above
-    text = text.replace("\u0625", "\u0627") # Alif Hamza Below
-    
-    # Unify Ya / Alif Maqsura
-    text = text.replace("\u0649", "\u064A") # Alif Maqsura -> Ya
-    
-    # Unify Taa Marbuta
-    text = text.replace("\u0629", "\u0647") # Taa Marbuta -> Ha
-    
-    # Remove invisible chars
-    text = text.replace("\u200B", "").replace("\u200E", "").replace("\u200F", "")
-    
-    # Normalize spaces
-    return " ".join(text.split())
-
 def delete_user(uid):
     print(f"Deleting user {uid}...")
     try:
@@ -2,30 +2,9 @@ import sqlite3
 import time
 import os
 
-DB_FILE = "khatma.db"
+from normalizer import normalize_arabic
 
-def normalize_arabic(text):
-    text = text or ""
-    # Remove tashkeel
-    tashkeel = ["\u064B", "\u064C", "\u064D", "\u064E", "\u064F", "\u0650", "\u0651", "\u0652"]
-    for t in tashkeel: text = text.replace(t, "")
-    
-    # Unify Alef
-    text = text.replace("\u0622", "\u0627") # Alif Madda
-    text = text.replace("\u0623", "\u0627") # Alif Hamza Above
-    text = text.replace("\u0625", "\u0627") # Alif Hamza Below
-    
-    # Unify Ya / Alif Maqsura
-    text = text.replace("\u0649", "\u064A") # Alif Maqsura -> Ya
-    
-    # Unify Taa Marbuta
-    text = text.replace("\u0629", "\u0647") # Taa Marbuta -> Ha
-    
-    # Remove invisible chars
-    text = text.replace("\u200B", "").replace("\u200E", "").replace("\u200F", "")
-    
-    # Normalize spaces
-    return " ".join(text.split())
+DB_FILE = "khatma.db"
 
 def fix_duplicates():
     print(f"Connecting to {DB_FILE}...")
@@ -108,11 +87,18 @@ def fix_duplicates():
     conn.commit()
     print(f"Done. Fixed {total_fixed} duplicate users.")
     
-    # Try creating index now
+    # Fill normalized_name for the survivors (rows the app's backfill had to skip)
+    rows = c.execute("SELECT id, full_name FROM users WHERE normalized_name IS NULL").fetchall()
+    c.executemany("UPDATE users SET normalized_name = ? WHERE id = ?", [(normalize_arabic(n), uid) for uid, n in rows])
+    conn.commit()
+    print(f"Filled normalized_name for {len(rows)} users.")
+
+    # Try creating indexes now
     try:
-        print("Creating Unique Index...")
+        print("Creating Unique Indexes...")
         c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_khatma_user_name ON users(khatma_id, full_name)")
-        print("Index created successfully.")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_khatma_user_norm ON users(khatma_id, normalized_name)")
+        print("Indexes created successfully.")
     except Exception as e:
         print(f"Failed to create index: {e}")
         
@@ -0,0 +1,26 @@
+# Gunicorn settings, picked up automatically when gunicorn runs from this directory:
+#     gunicorn app:app
+#
+# /api/stream holds a request thread open for up to SSE_MAX_AGE seconds, so sync
+# workers (one request at a time) would be pinned by a few open tabs. gthread
+# workers serve each request on a thread of their own; keep `threads` well above
+# SSE_MAX_STREAMS (app.py) so streams never take every thread.
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:" + os.environ.get("PORT", "8000"))
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+timeout = 60
+
+
+def post_worker_init(worker):
+    # Rollover recovery and the Telegram reminder sweep run without waiting for traffic
+    from app import start_background
+    start_background()
+
+
+def worker_exit(server, worker):
+    # Close the pooled SQLite handles instead of leaving them to interpreter teardown
+    from app import db
+    db.pool.close_all()
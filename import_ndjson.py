@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Bulk import / restore from the NDJSON that /api/dev/export streams.
+
+Rows go in with executemany, --batch rows at a time, and are committed every
+--chunk rows. While the load runs the database is tuned for it: synchronous=OFF,
+and the non-unique indexes and search triggers are dropped, then rebuilt once at
+the end together with the other derived data (normalized names and search text,
+progress counters, the search index). The activity feed of an imported khatma starts empty.
+
+Khatmas that already exist are skipped with all their rows, unless --replace is
+given, which deletes the existing copy first. Negative (web) user ids that are
+already taken by another user get fresh ids, and every reference in the import
+follows them. A failed import leaves the committed chunks in place; rerun it with
+--replace.
+
+Usage:
+    python3 import_ndjson.py backup.ndjson [path/to/khatma.db] [--replace] [--batch N] [--chunk N]
+    (use - to read the backup from stdin)
+"""
+import json
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+from normalizer import normalize_arabic
+import counters
+import migrations
+
+GLOBAL_GID = 1
+BATCH = 5000
+CHUNK = 200_000
+
+TABLES = ("khatmas", "settings", "users", "hizb_assignments", "completed_hizb", "intentions", "khatma_rounds", "round_readings")
+USER_REFS = ("hizb_assignments", "completed_hizb", "intentions", "round_readings")  # Tables with a user_id column
+
+
+class Importer:
+    def __init__(self, conn, replace=False, batch=BATCH, chunk=CHUNK, log=print):
+        self.conn, self.replace, self.batch, self.chunk, self.log = conn, replace, batch, chunk, log
+        self.wanted = {}          # khatma_id ("" = global) -> import its rows?
+        self.uid_map = {}         # remapped web uid -> fresh uid
+        self.admins = []          # (khatma_id, admin_uid) of imported khatmas, fixed up after a remap
+        self.skipped_rounds = set()
+        self.loaded, self.skipped = Counter(), Counter()
+        # Autoincrement ids are shifted past the current maximum; nothing outside the import refers to them
+        self.round_offset = conn.execute("SELECT COALESCE(MAX(id), 0) FROM khatma_rounds").fetchone()[0]
+        self.intention_offset = conn.execute("SELECT COALESCE(MAX(id), 0) FROM intentions").fetchone()[0]
+        self.next_uid = min(conn.execute("SELECT COALESCE(MIN(id), 0) FROM users").fetchone()[0], -int(time.time())) - 1
+        self.deferred = []        # Users waiting for a fresh id until every backup uid has been seen
+        self.pending = 0
+
+    # --- Scope ---
+    def _wants(self, khatma_id):
+        key = khatma_id or ""
+        if key not in self.wanted:
+            exists = self._exists(khatma_id)
+            if exists and self.replace: self._delete(khatma_id)
+            self.wanted[key] = not exists or self.replace
+            if exists: self.log(f"  {'replacing' if self.replace else 'skipping existing'} khatma {khatma_id or 'global'}")
+        return self.wanted[key]
+
+    def _exists(self, khatma_id):
+        if khatma_id:
+            return bool(self.conn.execute("SELECT 1 FROM khatmas WHERE id = ?", (khatma_id,)).fetchone())
+        return bool(self.conn.execute("""SELECT 1 FROM users WHERE khatma_id IS NULL
+                                         UNION ALL SELECT 1 FROM completed_hizb WHERE group_id = ?
+                                         UNION ALL SELECT 1 FROM hizb_assignments WHERE group_id = ? LIMIT 1""",
+                                      (GLOBAL_GID, GLOBAL_GID)).fetchone())
+
+    def _delete(self, khatma_id):
+        c = self.conn
+        if khatma_id:
+            c.execute("DELETE FROM khatmas WHERE id = ?", (khatma_id,))
+            for table in ("settings", "users", "hizb_assignments", "completed_hizb", "intentions", "activity_events", "bot_chats"):
+                c.execute(f"DELETE FROM {table} WHERE khatma_id = ?", (khatma_id,))
+        else:
+            c.execute("DELETE FROM settings WHERE khatma_id IS NULL")  # NULL keys never conflict on REPLACE
+            c.execute("DELETE FROM users WHERE khatma_id IS NULL")
+            c.execute("DELETE FROM hizb_assignments WHERE group_id = ?", (GLOBAL_GID,))
+            c.execute("DELETE FROM completed_hizb WHERE group_id = ?", (GLOBAL_GID,))
+            c.execute("DELETE FROM intentions WHERE khatma_id IS NULL")
+        c.execute("DELETE FROM round_readings WHERE round_id IN (SELECT id FROM khatma_rounds WHERE COALESCE(khatma_id, '') = ?)", (khatma_id or "",))
+        c.execute("DELETE FROM khatma_rounds WHERE COALESCE(khatma_id, '') = ?", (khatma_id or "",))
+
+    # --- Users ---
+    def _fresh_uid(self):
+        uid, self.next_uid = self.next_uid, self.next_uid - 1
+        return uid
+
+    def _remap_users(self, rows):
+        """Hold back users whose web uid is taken; returns the rest.
+
+        Web uids are -time() at creation, so two databases can easily share one.
+        Fresh ids must also miss every uid later in the backup, so they are handed
+        out by _place_deferred once the users section is over, below all of them.
+        """
+        self.next_uid = min(self.next_uid, min(r["id"] for r in rows) - 1)
+        ids = [r["id"] for r in rows if r["id"] < 0]
+        taken = set()
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            taken.update(r[0] for r in self.conn.execute(f"SELECT id FROM users WHERE id IN ({','.join('?' * len(part))})", part))
+        self.deferred.extend(r for r in rows if r["id"] in taken)
+        return [r for r in rows if r["id"] not in taken]
+
+    def _place_deferred(self):
+        if not self.deferred: return
+        for r in self.deferred:
+            self.uid_map[r["id"]] = r["id"] = self._fresh_uid()
+        rows, self.deferred = self.deferred, []
+        self._load("users", rows)
+
+    # --- Load ---
+    def _insert(self, sql, params):
+        done = self.conn.executemany(sql, params).rowcount
+        self.pending += len(params)
+        if self.pending >= self.chunk:
+            self.conn.commit(); self.pending = 0
+        return done
+
+    def flush(self, table, rows):
+        if table == "round_readings":
+            keep = [r for r in rows if r["round_id"] not in self.skipped_rounds]
+        elif table == "khatmas":
+            keep = [r for r in rows if self._wants(r["id"])]
+        else:
+            keep = [r for r in rows if self._wants(r.get("khatma_id"))]
+        if table == "khatma_rounds":
+            self.skipped_rounds.update(r["id"] for r in rows if not self._wants(r.get("khatma_id")))
+        self.skipped[table] += len(rows) - len(keep)
+        if not keep: return
+
+        if table == "users":
+            for r in keep: r["normalized_name"] = normalize_arabic(r.get("full_name"))
+            keep = self._remap_users(keep)
+        elif table in USER_REFS:
+            for r in keep: r["user_id"] = self.uid_map.get(r.get("user_id"), r.get("user_id"))
+        if table == "khatmas":
+            self.admins.extend((r["id"], r["admin_uid"]) for r in keep if r.get("admin_uid"))
+            for r in keep:
+                r["normalized_name"], r["normalized_intention"] = normalize_arabic(r.get("name")), normalize_arabic(r.get("intention"))
+        elif table == "intentions":
+            for r in keep:
+                r["id"] += self.intention_offset; r["normalized_text"] = normalize_arabic(r.get("text"))
+        elif table == "khatma_rounds":
+            for r in keep: r["id"] += self.round_offset
+        elif table == "round_readings":
+            for r in keep: r["round_id"] += self.round_offset
+
+        self._load(table, keep)
+
+    def _load(self, table, keep):
+        if not keep: return
+        cols = list(keep[0])
+        verb = "INSERT OR REPLACE" if table == "settings" else "INSERT OR IGNORE"
+        done = self._insert(f"{verb} INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                            [tuple(r.get(c) for c in cols) for r in keep])
+        self.loaded[table] += done
+        self.skipped[table] += len(keep) - done  # Duplicates within the backup itself
+
+    def run(self, lines):
+        started = last = time.perf_counter()
+        table, rows, n = None, [], 0
+        for line in lines:
+            if not line.strip(): continue
+            row = json.loads(line)
+            t = row.pop("table", None)
+            if t == "_meta":
+                if row.get("schema", 0) > migrations.LATEST:
+                    raise SystemExit(f"❌ Backup is from schema v{row['schema']}; this database is at v{migrations.LATEST}")
+                continue
+            if t not in TABLES: raise SystemExit(f"❌ Line {n + 1}: unknown table {t!r}")
+            if t != table or len(rows) >= self.batch:
+                if rows: self.flush(table, rows)
+                if t != table: self._place_deferred()  # Before any row that may refer to a remapped user
+                table, rows = t, []
+            rows.append(row); n += 1
+            if time.perf_counter() - last >= 1:
+                last = time.perf_counter()
+                self.log(f"  {n:,} rows ({n / (last - started):,.0f}/s)")
+        if rows: self.flush(table, rows)
+        self._place_deferred()
+        for kid, old in self.admins:
+            if old in self.uid_map:
+                self.conn.execute("UPDATE khatmas SET admin_uid = ? WHERE id = ?", (self.uid_map[old], kid))
+        self.conn.commit()
+        return n, time.perf_counter() - started
+
+
+def bulk_load(conn, replace=False):
+    """Tune the connection for a bulk load; returns a function that undoes it and rebuilds what was dropped."""
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -65536")  # 64 MB
+    conn.execute("PRAGMA temp_store = MEMORY")
+    marks = ",".join("?" * len(TABLES))
+    # Unique indexes stay: INSERT OR IGNORE relies on them. With --replace so do the ones led by
+    # khatma_id / group_id, or every replaced khatma's delete would scan the whole table.
+    indexes = [(name, sql) for name, sql in conn.execute(f"""
+                   SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL
+                   AND tbl_name IN ({marks}) AND sql NOT LIKE 'CREATE UNIQUE%'""", TABLES).fetchall()
+               if not (replace and conn.execute(f"PRAGMA index_info({name})").fetchone()[2] in ("khatma_id", "group_id"))]
+    search = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'khatma_search'").fetchone()
+    for name, _ in indexes: conn.execute(f"DROP INDEX {name}")
+    if search:
+        for trigger in migrations.SEARCH_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger.split()[5]}")
+    conn.commit()
+
+    def finish(log=print):
+        started = time.perf_counter()
+        for _, sql in indexes: conn.execute(sql)
+        if search: migrations.rebuild_search(conn)
+        counters.repair(conn)
+        conn.commit()
+        conn.execute("PRAGMA synchronous = NORMAL")
+        log(f"  rebuilt {len(indexes)} indexes{', the search index' if search else ''} and counters in {time.perf_counter() - started:.1f}s")
+    return finish
+
+
+if __name__ == "__main__":
+    args, opts = [], {"--batch": BATCH, "--chunk": CHUNK}
+    argv = iter(sys.argv[1:])
+    for a in argv:
+        if a in ("--batch", "--chunk"): opts[a] = int(next(argv))
+        elif a.startswith("--"): opts[a] = True
+        else: args.append(a)
+    if not args: raise SystemExit(__doc__)
+    source, path = args[0], args[1] if len(args) > 1 else "khatma.db"
+
+    conn = sqlite3.connect(path, timeout=30)
+    migrations.migrate(conn)
+    finish = bulk_load(conn, replace="--replace" in opts)
+    importer = Importer(conn, replace="--replace" in opts, batch=opts["--batch"], chunk=opts["--chunk"])
+    f = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        n, took = importer.run(f)
+    finally:
+        finish()
+        if f is not sys.stdin: f.close()
+    conn.close()
+    for table in TABLES:
+        if importer.loaded[table] or importer.skipped[table]:
+            print(f"  {table}: {importer.loaded[table]:,} loaded, {importer.skipped[table]:,} skipped")
+    if importer.uid_map: print(f"  remapped {len(importer.uid_map):,} web user ids")
+    print(f"✅ Imported {n:,} rows in {took:.1f}s ({n / max(took, 1e-9):,.0f} rows/s)")
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for khatma.db.
+
+The app runs these from DatabaseManager.init_db; the applied version is stored in
+the schema_version table, so a booting worker only does a single SELECT when the
+schema is current. Each migration runs in its own BEGIN IMMEDIATE transaction and
+re-checks the version inside it, so several gunicorn workers can boot at once.
+
+Append new migrations to MIGRATIONS; never edit or renumber one that has shipped.
+
+Usage (replaces the old migrate.py / migrate_timestamp.py):
+    python3 migrations.py [path/to/khatma.db]
+"""
+import sqlite3
+import sys
+import time
+
+from normalizer import normalize_arabic
+import counters
+
+GLOBAL_GID = 1
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column, definition):
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def base_schema(conn):
+    """Tables as they stood before versioning, plus the columns older databases lack."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS khatmas (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        admin_uid INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        intention TEXT,
+        deadline TEXT,
+        total_khatmas INTEGER DEFAULT 0,
+        is_active INTEGER DEFAULT 1,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    # Legacy tables (keeping for Telegram bot compatibility)
+    conn.execute('CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, title TEXT, last_update REAL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, full_name TEXT, username TEXT, web_pin TEXT, khatma_id TEXT)')
+    conn.execute("""CREATE TABLE IF NOT EXISTS hizb_assignments (
+        group_id INTEGER,
+        user_id INTEGER,
+        hizb_number INTEGER,
+        khatma_id TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (khatma_id, hizb_number)
+    )""")
+    conn.execute('CREATE TABLE IF NOT EXISTS completed_hizb (id INTEGER PRIMARY KEY AUTOINCREMENT, group_id INTEGER, user_id INTEGER, hizb_number INTEGER, khatma_id TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+    conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT, value TEXT, khatma_id TEXT, PRIMARY KEY (key, khatma_id))')
+    conn.execute('CREATE TABLE IF NOT EXISTS intentions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT, text TEXT, timestamp REAL, khatma_id TEXT)')
+    # Per-khatma change log for delta sync
+    conn.execute("""CREATE TABLE IF NOT EXISTS khatma_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        khatma_id TEXT,
+        prev_version REAL,
+        version REAL,
+        kind TEXT,
+        user_id INTEGER,
+        user_name TEXT,
+        hizb INTEGER,
+        payload TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_khatma_changes_prev ON khatma_changes(khatma_id, prev_version)")
+
+    # Columns added after the first deployments. SQLite refuses a non-constant
+    # DEFAULT in ALTER TABLE, so the timestamp columns are added bare.
+    _add_column(conn, "khatmas", "updated_at", "TIMESTAMP")
+    for table in ("users", "hizb_assignments", "completed_hizb", "settings", "intentions"):
+        _add_column(conn, table, "khatma_id", "TEXT")
+    _add_column(conn, "hizb_assignments", "timestamp", "DATETIME")
+    _add_column(conn, "completed_hizb", "timestamp", "DATETIME")
+
+    # Prevents two users with the same name being created in parallel. Old
+    # databases may still hold duplicates (see fix_duplicates.py).
+    try:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_khatma_user_name ON users(khatma_id, full_name)")
+    except sqlite3.IntegrityError:
+        print("⚠️  Duplicate member names; run fix_duplicates.py to create idx_khatma_user_name")
+
+    # Versions are numeric (time.time()); reset any legacy text timestamps
+    conn.execute("UPDATE khatmas SET updated_at = ? WHERE typeof(updated_at) = 'text'", (time.time(),))
+    conn.execute("UPDATE groups SET last_update = ? WHERE typeof(last_update) = 'text'", (time.time(),))
+
+    # Global state for the Telegram bot
+    conn.execute("INSERT OR IGNORE INTO groups (id, title, last_update) VALUES (?, ?, ?)", (GLOBAL_GID, "Main Khatma", time.time()))
+
+
+def normalized_names(conn):
+    """users.normalized_name, backfilled, with a unique index per khatma."""
+    _add_column(conn, "users", "normalized_name", "TEXT")
+    # Re-key every member under the current normaliser. Within a khatma each key goes to one
+    # member: the one whose name is already in normal form ("محمد" over "محـمد"), then the
+    # lowest id. The others are left NULL until fix_duplicates.py merges them.
+    groups = {}
+    for uid, kid, full_name in conn.execute("SELECT id, khatma_id, full_name FROM users"):
+        groups.setdefault((kid, normalize_arabic(full_name)), []).append((uid, full_name))
+    fills, dupes = [], 0
+    for (kid, norm), members in groups.items():
+        if kid is None: # Global (Telegram) members are keyed by id; the index does not constrain them
+            fills.extend((norm, uid) for uid, _ in members); continue
+        members.sort(key=lambda m: (m[1] != norm, m[0]))
+        (keep, keep_name), others = members[0], members[1:]
+        fills.append((norm, keep))
+        if others:
+            print(f"⚠️  Duplicate in khatma {kid}: '{norm}' -> KEEP {keep} ({keep_name}), "
+                  + ", ".join(f"NULL {uid} ({name})" for uid, name in others))
+            dupes += len(others)
+    conn.execute("UPDATE users SET normalized_name = NULL WHERE normalized_name IS NOT NULL")
+    conn.executemany("UPDATE users SET normalized_name = ? WHERE id = ?", fills)
+    if dupes: print(f"⚠️  {dupes} users share a normalized name with another member; run fix_duplicates.py")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_khatma_user_norm ON users(khatma_id, normalized_name)")
+
+
+def query_indexes(conn):
+    """Covering indexes for the per-khatma and per-member board queries."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_assign_khatma_user ON hizb_assignments(khatma_id, user_id, hizb_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_assign_group ON hizb_assignments(group_id, hizb_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completed_khatma ON completed_hizb(khatma_id, hizb_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completed_khatma_user ON completed_hizb(khatma_id, user_id, hizb_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completed_khatma_ts ON completed_hizb(khatma_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_completed_group ON completed_hizb(group_id, hizb_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_intentions_khatma ON intentions(khatma_id, id)")
+    # users(khatma_id) lookups are already served by the (khatma_id, ...) unique indexes
+
+
+def progress_counters(conn):
+    """Materialised counters, kept up to date by the app's mutation paths."""
+    for column in ("active_count", "completed_count", "user_count"):
+        _add_column(conn, "khatmas", column, "INTEGER NOT NULL DEFAULT 0")
+    for column in ("active_count", "completed_count"):
+        _add_column(conn, "users", column, "INTEGER NOT NULL DEFAULT 0")
+    counters.repair(conn)
+
+
+def khatma_listing_index(conn):
+    """Keyset pagination of the dev listing on (updated_at, id)."""
+    conn.execute("UPDATE khatmas SET updated_at = ? WHERE updated_at IS NULL", (time.time(),))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_khatmas_updated ON khatmas(updated_at, id)")
+
+
+# Search documents: one per khatma (name, intention, code), member (member) and
+# intention (intention). The rowid encodes the source row so triggers can find it.
+# The triggers as migration 6 shipped them; migration 11 (search_text) replaces them.
+_SEARCH_TRIGGERS_V6 = [
+    """CREATE TRIGGER IF NOT EXISTS khatmas_search_ins AFTER INSERT ON khatmas BEGIN
+        INSERT INTO khatma_search (rowid, name, intention, code, khatma_id)
+        VALUES (NEW.rowid * 4, normalize_arabic(NEW.name), normalize_arabic(NEW.intention), NEW.id, NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS khatmas_search_upd AFTER UPDATE OF name, intention ON khatmas BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.rowid * 4;
+        INSERT INTO khatma_search (rowid, name, intention, code, khatma_id)
+        VALUES (NEW.rowid * 4, normalize_arabic(NEW.name), normalize_arabic(NEW.intention), NEW.id, NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS khatmas_search_del AFTER DELETE ON khatmas BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.rowid * 4;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_ins AFTER INSERT ON users WHEN NEW.khatma_id IS NOT NULL BEGIN
+        INSERT INTO khatma_search (rowid, member, khatma_id) VALUES (NEW.id * 4 + 1, NEW.normalized_name, NEW.khatma_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_upd AFTER UPDATE OF normalized_name, khatma_id ON users BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.id * 4 + 1;
+        INSERT INTO khatma_search (rowid, member, khatma_id)
+        SELECT NEW.id * 4 + 1, NEW.normalized_name, NEW.khatma_id WHERE NEW.khatma_id IS NOT NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_del AFTER DELETE ON users BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.id * 4 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS intentions_search_ins AFTER INSERT ON intentions WHEN NEW.khatma_id IS NOT NULL BEGIN
+        INSERT INTO khatma_search (rowid, intention, khatma_id) VALUES (NEW.id * 4 + 2, normalize_arabic(NEW.text), NEW.khatma_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS intentions_search_del AFTER DELETE ON intentions BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.id * 4 + 2;
+    END""",
+]
+
+
+# Current triggers: they copy the normalised text the writer stored, so they call no
+# SQL function and any plain sqlite3 connection can write these tables.
+SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS khatmas_search_ins AFTER INSERT ON khatmas BEGIN
+        INSERT INTO khatma_search (rowid, name, intention, code, khatma_id)
+        VALUES (NEW.rowid * 4, NEW.normalized_name, NEW.normalized_intention, NEW.id, NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS khatmas_search_upd AFTER UPDATE OF normalized_name, normalized_intention ON khatmas BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.rowid * 4;
+        INSERT INTO khatma_search (rowid, name, intention, code, khatma_id)
+        VALUES (NEW.rowid * 4, NEW.normalized_name, NEW.normalized_intention, NEW.id, NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS khatmas_search_del AFTER DELETE ON khatmas BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.rowid * 4;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_ins AFTER INSERT ON users WHEN NEW.khatma_id IS NOT NULL BEGIN
+        INSERT INTO khatma_search (rowid, member, khatma_id) VALUES (NEW.id * 4 + 1, NEW.normalized_name, NEW.khatma_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_upd AFTER UPDATE OF normalized_name, khatma_id ON users BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.id * 4 + 1;
+        INSERT INTO khatma_search (rowid, member, khatma_id)
+        SELECT NEW.id * 4 + 1, NEW.normalized_name, NEW.khatma_id WHERE NEW.khatma_id IS NOT NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_search_del AFTER DELETE ON users BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.id * 4 + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS intentions_search_ins AFTER INSERT ON intentions WHEN NEW.khatma_id IS NOT NULL BEGIN
+        INSERT INTO khatma_search (rowid, intention, khatma_id) VALUES (NEW.id * 4 + 2, NEW.normalized_text, NEW.khatma_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS intentions_search_del AFTER DELETE ON intentions BEGIN
+        DELETE FROM khatma_search WHERE rowid = OLD.id * 4 + 2;
+    END""",
+]
+
+
+def khatma_search(conn):
+    """FTS5 index over khatma names/intentions and member names, Arabic-normalised."""
+    try:
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS khatma_search USING fts5(
+            name, intention, member, code, khatma_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+        )""")
+    except sqlite3.OperationalError as e: # SQLite built without FTS5: the app falls back to LIKE
+        print(f"⚠️  Khatma search index not created ({e})")
+        return
+    # Rank: khatma name / code matches first, then member names, then intention text
+    conn.execute("INSERT INTO khatma_search (khatma_search, rank) VALUES ('rank', 'bm25(10.0, 1.0, 4.0, 10.0)')")
+    for trigger in _SEARCH_TRIGGERS_V6: conn.execute(trigger)
+    conn.execute("DELETE FROM khatma_search")
+    # In rowid order: FTS5 appends to its doclists far faster than it inserts into them
+    conn.execute("""INSERT INTO khatma_search (rowid, name, intention, code, khatma_id)
+                    SELECT rowid * 4, normalize_arabic(name), normalize_arabic(intention), id, id FROM khatmas ORDER BY 1""")
+    conn.execute("""INSERT INTO khatma_search (rowid, member, khatma_id)
+                    SELECT id * 4 + 1, normalized_name, khatma_id FROM users WHERE khatma_id IS NOT NULL ORDER BY 1""")
+    conn.execute("""INSERT INTO khatma_search (rowid, intention, khatma_id)
+                    SELECT id * 4 + 2, normalize_arabic(text), khatma_id FROM intentions WHERE khatma_id IS NOT NULL ORDER BY 1""")
+
+
+def activity_events(conn):
+    """Append-only per-khatma event log (replaces the trimmed khatma_changes).
+
+    It feeds both delta sync (/api/khatma/changes) and the activity feed. History
+    from before the log existed is reconstructed from the board as version-less
+    events, so it shows in the feed but is never replayed; clients holding an old
+    version simply fetch one full snapshot.
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS activity_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        khatma_id TEXT,
+        prev_version REAL,
+        version REAL,
+        kind TEXT,
+        user_id INTEGER,
+        user_name TEXT,
+        hizb INTEGER,
+        payload TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("""INSERT INTO activity_events (khatma_id, kind, user_id, user_name, hizb, timestamp)
+                    SELECT b.khatma_id, b.kind, b.user_id, u.full_name, b.hizb_number, b.timestamp FROM (
+                        SELECT khatma_id, 'assign' AS kind, user_id, hizb_number, timestamp FROM hizb_assignments WHERE khatma_id IS NOT NULL
+                        UNION ALL
+                        SELECT khatma_id, 'done', user_id, hizb_number, timestamp FROM completed_hizb WHERE khatma_id IS NOT NULL
+                    ) b LEFT JOIN users u ON u.id = b.user_id
+                    ORDER BY b.timestamp, b.hizb_number""")
+    conn.execute("DROP TABLE IF EXISTS khatma_changes")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_khatma ON activity_events(khatma_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activity_prev ON activity_events(khatma_id, prev_version)")
+
+
+def bot_chats(conn):
+    """Telegram chats linked to a khatma for notifications (khatma_id NULL = the
+    global khatma), and a claim log so each reminder goes out once even when
+    several workers run the sweep."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS bot_chats (
+        chat_id INTEGER PRIMARY KEY,
+        khatma_id TEXT,
+        linked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_chats_khatma ON bot_chats(khatma_id)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS notification_log (
+        key TEXT PRIMARY KEY,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID""")
+
+
+def khatma_rounds(conn):
+    """Archive of finished rounds: one khatma_rounds row per rollover and the
+    readings it held. round_readings is WITHOUT ROWID, clustered on (round_id,
+    hizb), so a round's 60 readings sit together and cost no extra rowid index.
+    Rounds are numbered per khatma; (khatma, round_no) is unique."""
+    conn.execute("""CREATE TABLE IF NOT EXISTS khatma_rounds (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        khatma_id TEXT,
+        round_no INTEGER NOT NULL,
+        started_at TIMESTAMP,
+        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        readings INTEGER
+    )""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_rounds_khatma ON khatma_rounds(COALESCE(khatma_id, ''), round_no)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS round_readings (
+        round_id INTEGER NOT NULL,
+        hizb INTEGER NOT NULL,
+        user_id INTEGER,
+        user_name TEXT,
+        completed_at TIMESTAMP,
+        PRIMARY KEY (round_id, hizb)
+    ) WITHOUT ROWID""")
+
+
+def round_statistics(conn):
+    """Per-round aggregates on khatma_rounds, and booking times so rounds can
+    report how long a hizb takes to read. Rounds archived before this have no
+    booking times, so their median stays NULL."""
+    _add_column(conn, "completed_hizb", "assigned_at", "DATETIME")
+    _add_column(conn, "round_readings", "assigned_at", "TIMESTAMP")
+    _add_column(conn, "khatma_rounds", "participants", "INTEGER")
+    _add_column(conn, "khatma_rounds", "duration_s", "INTEGER")
+    _add_column(conn, "khatma_rounds", "median_read_s", "INTEGER")
+    conn.execute("""UPDATE khatma_rounds SET
+        participants = (SELECT COUNT(DISTINCT user_id) FROM round_readings WHERE round_id = khatma_rounds.id),
+        duration_s = strftime('%s', completed_at) - strftime('%s', started_at)""")
+
+
+def search_text(conn):
+    """Normalised search text stored beside the source columns, like users.normalized_name.
+
+    Writers fill khatmas.normalized_name / normalized_intention and
+    intentions.normalized_text with normalizer.normalize_arabic; the search triggers
+    copy them. A script that writes name, intention or text without them leaves the
+    row unsearchable until it sets them, but it no longer fails.
+    """
+    _add_column(conn, "khatmas", "normalized_name", "TEXT")
+    _add_column(conn, "khatmas", "normalized_intention", "TEXT")
+    _add_column(conn, "intentions", "normalized_text", "TEXT")
+    conn.execute("UPDATE khatmas SET normalized_name = normalize_arabic(name), normalized_intention = normalize_arabic(intention)")
+    conn.execute("UPDATE intentions SET normalized_text = normalize_arabic(text)")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'khatma_search'").fetchone():
+        for name in ("khatmas_search_ins", "khatmas_search_upd", "intentions_search_ins"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for trigger in SEARCH_TRIGGERS: conn.execute(trigger)
+
+
+def rebuild_search(conn):
+    """Recreate the search triggers and reindex every document from the stored normalised text."""
+    for trigger in SEARCH_TRIGGERS: conn.execute(trigger)
+    conn.execute("DELETE FROM khatma_search")
+    # In rowid order: FTS5 appends to its doclists far faster than it inserts into them
+    conn.execute("""INSERT INTO khatma_search (rowid, name, intention, code, khatma_id)
+                    SELECT rowid * 4, normalized_name, normalized_intention, id, id FROM khatmas ORDER BY 1""")
+    conn.execute("""INSERT INTO khatma_search (rowid, member, khatma_id)
+                    SELECT id * 4 + 1, normalized_name, khatma_id FROM users WHERE khatma_id IS NOT NULL ORDER BY 1""")
+    conn.execute("""INSERT INTO khatma_search (rowid, intention, khatma_id)
+                    SELECT id * 4 + 2, normalized_text, khatma_id FROM intentions WHERE khatma_id IS NOT NULL ORDER BY 1""")
+
+
+def hizb_range(conn):
+    """Drop board rows whose hizb_number is outside 1..60.
+
+    The old API accepted any integer, and the board cannot represent such a row;
+    HizbBoard skips them on read, this removes them and fixes the counters.
+    """
+    for table in ("hizb_assignments", "completed_hizb"):
+        n = conn.execute(f"DELETE FROM {table} WHERE typeof(hizb_number) != 'integer' OR hizb_number NOT BETWEEN 1 AND 60").rowcount
+        if n: print(f"⚠️  Removed {n} {table} rows with an out-of-range hizb_number")
+    counters.repair(conn)
+
+
+def round_readings_count(conn):
+    """khatma_rounds.readings recounted from the archived rows (duplicate hizbs were counted before)."""
+    conn.execute("UPDATE khatma_rounds SET readings = (SELECT COUNT(*) FROM round_readings WHERE round_id = khatma_rounds.id)")
+
+
+def notification_claims(conn):
+    """notification_log.claimed_at: a row is a claim until sent_at is set after the send succeeds."""
+    _add_column(conn, "notification_log", "claimed_at", "REAL")
+
+
+MIGRATIONS = [
+    (1, "base schema", base_schema),
+    (2, "normalized names", normalized_names),
+    (3, "query indexes", query_indexes),
+    (4, "progress counters", progress_counters),
+    (5, "khatma listing index", khatma_listing_index),
+    (6, "khatma search", khatma_search),
+    (7, "activity events", activity_events),
+    (8, "bot chats", bot_chats),
+    (9, "khatma rounds", khatma_rounds),
+    (10, "round statistics", round_statistics),
+    (11, "search text", search_text),
+    (12, "hizb range", hizb_range),
+    (13, "round readings count", round_readings_count),
+    (14, "notification claims", notification_claims),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+    except sqlite3.OperationalError: # No schema_version table yet
+        return 0
+
+
+def migrate(conn, log=print):
+    """Apply pending migrations in order. Returns the list of versions applied."""
+    if current_version(conn) >= LATEST: return []
+    conn.create_function("normalize_arabic", 1, normalize_arabic, deterministic=True)
+    conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    if conn.in_transaction: conn.commit()
+    applied = []
+    for version, name, step in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if current_version(conn) >= version: # Applied already (possibly by another worker)
+                conn.rollback(); continue
+            step(conn)
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        log(f"🗄️  Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "khatma.db"
+    conn = sqlite3.connect(path)
+    print(f"Migrating {path} (schema version {current_version(conn)} -> {LATEST})")
+    migrate(conn)
+    conn.close()
+    print("✅ Schema is up to date.")
@@ -0,0 +1,51 @@
+"""Arabic name normalisation shared by the web app and the maintenance scripts.
+
+Two spellings of the same name ("أحمد" / "احمد", "فاطمة" / "فاطمه", with or
+without tashkeel) must normalise to the same key. All character rules live in
+one translate table applied in a single pass; results are memoised because the
+same few hundred member names are normalised over and over.
+
+The table is a list indexed by code point rather than a dict: str.translate then
+does a plain sequence lookup per character (code points past the end are left
+alone), which is what makes one pass competitive with a chain of str.replace.
+"""
+from functools import lru_cache
+
+NORMALIZE_CACHE_SIZE = 4096
+
+_DROP = [
+    *range(0x0610, 0x061B),  # Quranic honorifics / small signs
+    *range(0x064B, 0x0660),  # Tashkeel: tanween, harakat, shadda, sukun, madda/hamza marks
+    0x0670,                  # Superscript alef
+    *range(0x06D6, 0x06DD), *range(0x06DF, 0x06E9), *range(0x06EA, 0x06EE),  # Quranic annotation
+    0x0640,                  # Tatweel
+    0x061C,                  # Arabic letter mark
+    *range(0x200B, 0x2010),  # ZWSP, ZWNJ, ZWJ, LRM, RLM
+    *range(0x202A, 0x202F),  # Bidi embeddings / overrides
+    *range(0x2066, 0x206A),  # Bidi isolates
+]
+_BOM = "\ufeff"  # Outside the table; stripped separately
+
+_MAP = {
+    0x0622: "\u0627", 0x0623: "\u0627", 0x0625: "\u0627",  # Alef madda / hamza above / below -> alef
+    0x0671: "\u0627", 0x0672: "\u0627", 0x0673: "\u0627",  # Alef wasla / wavy hamza variants -> alef
+    0x0649: "\u064A", 0x06CC: "\u064A",                    # Alef maqsura / Farsi yeh -> ya
+    0x0629: "\u0647",                                      # Taa marbuta -> ha
+}
+
+TRANSLATION = list(range(max(_DROP) + 1))
+for _cp in _DROP: TRANSLATION[_cp] = None
+for _cp, _to in _MAP.items(): TRANSLATION[_cp] = _to
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize(text):
+    text = text.translate(TRANSLATION)
+    if _BOM in text: text = text.replace(_BOM, "")
+    return " ".join(text.split())
+
+
+def normalize_arabic(text):
+    """Normalise a member name for matching; None and non-strings are accepted."""
+    if not text: return ""
+    return _normalize(text if isinstance(text, str) else str(text))
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+# Before app is imported: its module-level DatabaseManager must not open the real khatma.db
+os.environ["KHATMA_DB"] = os.path.join(tempfile.mkdtemp(prefix="khatma-tests-"), "khatma.db")
+os.environ["BOT_TOKEN"] = ""
+
+import migrations
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """A fresh database at the latest schema."""
+    c = sqlite3.connect(tmp_path / "khatma.db")
+    migrations.migrate(c, log=lambda *a: None)
+    yield c
+    c.close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A DatabaseManager on its own fresh database, with no listeners attached."""
+    import app
+    manager = app.DatabaseManager(str(tmp_path / "app.db"))
+    yield manager
+    manager.pool.close_all()
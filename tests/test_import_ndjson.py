@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import subprocess
+import sys
+
+import import_ndjson
+from import_ndjson import Importer, TABLES
+
+WEB_UID = -5  # Web user ids are -time() at creation, so another database may hold the same one
+
+
+def backup(web_uid=WEB_UID, extra_uid=None):
+    """NDJSON lines for one khatma plus the global (bot) state, in export order."""
+    rows = [
+        {"table": "_meta", "schema": import_ndjson.migrations.LATEST},
+        {"table": "khatmas", "id": "k1", "name": "ختمة الأسرة", "admin_uid": web_uid, "intention": "رحمة"},
+        {"table": "settings", "key": "round", "value": "3", "khatma_id": "k1"},
+        {"table": "settings", "key": "round", "value": "7", "khatma_id": None},
+        {"table": "users", "id": 42, "full_name": "Bot user", "username": "bot", "web_pin": None, "khatma_id": None},
+        {"table": "users", "id": web_uid, "full_name": "أحمد", "username": None, "web_pin": "1234", "khatma_id": "k1"},
+    ]
+    if extra_uid is not None:
+        rows.append({"table": "users", "id": extra_uid, "full_name": "Later", "username": None, "web_pin": None, "khatma_id": "k1"})
+    rows += [
+        {"table": "hizb_assignments", "group_id": 1, "user_id": 42, "hizb_number": 1, "khatma_id": None},
+        {"table": "hizb_assignments", "group_id": 0, "user_id": web_uid, "hizb_number": 2, "khatma_id": "k1"},
+        {"table": "completed_hizb", "group_id": 1, "user_id": 42, "hizb_number": 3, "khatma_id": None},
+        {"table": "completed_hizb", "group_id": 0, "user_id": web_uid, "hizb_number": 4, "khatma_id": "k1"},
+        {"table": "intentions", "id": 1, "user_id": web_uid, "name": "أحمد", "text": "للوالدين", "timestamp": 1.0, "khatma_id": "k1"},
+        {"table": "khatma_rounds", "id": 1, "khatma_id": "k1", "round_no": 1, "readings": 1},
+        {"table": "round_readings", "round_id": 1, "hizb": 5, "user_id": web_uid, "user_name": "أحمد"},
+    ]
+    return [json.dumps(r, ensure_ascii=False) + "\n" for r in rows]
+
+
+def counts(conn):
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in TABLES}
+
+
+def test_replace_twice_keeps_row_counts(tmp_path):
+    path, db = tmp_path / "backup.ndjson", tmp_path / "khatma.db"
+    path.write_text("".join(backup()), encoding="utf-8")
+    cli = [sys.executable, import_ndjson.__file__, str(path), str(db)]
+    subprocess.run(cli, check=True, capture_output=True)
+    with sqlite3.connect(db) as c: first = counts(c)
+    assert first["settings"] == 2 and first["users"] == 2 and first["khatma_rounds"] == 1
+
+    for _ in range(2):
+        subprocess.run(cli + ["--replace"], check=True, capture_output=True)
+        with sqlite3.connect(db) as c: assert counts(c) == first
+    c = sqlite3.connect(db)
+    assert c.execute("SELECT value FROM settings WHERE khatma_id IS NULL").fetchall() == [("7",)]
+    c.close()
+
+
+def test_taken_web_uid_is_remapped_everywhere(conn):
+    conn.execute("INSERT INTO users (id, full_name, khatma_id) VALUES (?, 'Someone else', 'k0')", (WEB_UID,))
+    conn.commit()
+    importer = Importer(conn, log=lambda *a: None)
+    # A later backup user sits on the id the importer would hand out first; the fresh id must miss it
+    later = importer.next_uid
+    importer.run(backup(extra_uid=later))
+
+    fresh = importer.uid_map[WEB_UID]
+    assert fresh not in (WEB_UID, later) and fresh < later
+    assert conn.execute("SELECT full_name, khatma_id FROM users WHERE id = ?", (WEB_UID,)).fetchone() == ("Someone else", "k0")
+    assert conn.execute("SELECT full_name FROM users WHERE id = ?", (fresh,)).fetchone() == ("أحمد",)
+    assert conn.execute("SELECT full_name FROM users WHERE id = ?", (later,)).fetchone() == ("Later",)
+    assert conn.execute("SELECT admin_uid FROM khatmas WHERE id = 'k1'").fetchone() == (fresh,)
+    for table in ("hizb_assignments", "completed_hizb", "intentions", "round_readings"):
+        assert conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (fresh,)).fetchone() == (1,), table
+        assert conn.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (WEB_UID,)).fetchone() == (0,), table
+
+
+def test_existing_khatma_is_skipped_without_replace(conn):
+    Importer(conn, log=lambda *a: None).run(backup())
+    before = counts(conn)
+    importer = Importer(conn, log=lambda *a: None)
+    importer.run(backup())
+    assert counts(conn) == before and not importer.loaded
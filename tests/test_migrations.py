@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+import migrations
+from normalizer import normalize_arabic
+
+
+def quiet(*args): pass
+
+
+def schema(conn):
+    return conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+
+
+def migrate_to(conn, version, monkeypatch):
+    """Apply migrations up to `version` only, as an older release would have."""
+    with monkeypatch.context() as m:
+        m.setattr(migrations, "MIGRATIONS", [s for s in migrations.MIGRATIONS if s[0] <= version])
+        m.setattr(migrations, "LATEST", version)
+        migrations.migrate(conn, log=quiet)
+
+
+def test_fresh_database_is_at_latest(conn):
+    assert migrations.current_version(conn) == migrations.LATEST
+    assert migrations.migrate(conn, log=quiet) == []
+
+
+@pytest.mark.parametrize("version", range(1, migrations.LATEST))
+def test_upgrade_matches_fresh_schema(tmp_path, conn, monkeypatch, version):
+    old = sqlite3.connect(tmp_path / "old.db")
+    migrate_to(old, version, monkeypatch)
+    assert migrations.current_version(old) == version
+
+    assert migrations.migrate(old, log=quiet) == list(range(version + 1, migrations.LATEST + 1))
+    assert schema(old) == schema(conn)
+    old.close()
+
+
+def test_upgrade_backfills_derived_data(tmp_path, monkeypatch):
+    c = sqlite3.connect(tmp_path / "old.db")
+    migrate_to(c, 1, monkeypatch)
+    c.execute("INSERT INTO khatmas (id, name, intention, updated_at) VALUES ('k1', 'ختمة الوالدين', 'رَحمة', 1.0)")
+    c.execute("INSERT INTO users (id, full_name, khatma_id) VALUES (-1, 'محـمّد', 'k1')")
+    c.execute("INSERT INTO hizb_assignments (group_id, user_id, hizb_number, khatma_id) VALUES (0, -1, 3, 'k1'), (0, -1, 99, 'k1')")
+    c.execute("INSERT INTO completed_hizb (group_id, user_id, hizb_number, khatma_id) VALUES (0, -1, 4, 'k1'), (0, -1, 0, 'k1')")
+    c.execute("INSERT INTO intentions (user_id, name, text, khatma_id) VALUES (-1, 'محـمّد', 'للوالدَين', 'k1')")
+    c.commit()
+
+    migrations.migrate(c, log=quiet)
+
+    assert c.execute("SELECT normalized_name FROM users").fetchone() == (normalize_arabic("محـمّد"),)
+    assert c.execute("SELECT normalized_name, normalized_intention FROM khatmas").fetchone() == (
+        normalize_arabic("ختمة الوالدين"), normalize_arabic("رَحمة"))
+    # Migration 12 drops the out-of-range hizbs; the counters are then recounted from what is left
+    assert c.execute("SELECT hizb_number FROM hizb_assignments UNION ALL SELECT hizb_number FROM completed_hizb").fetchall() == [(3,), (4,)]
+    assert c.execute("SELECT active_count, completed_count, user_count FROM khatmas").fetchone() == (1, 1, 1)
+    assert c.execute("SELECT active_count, completed_count FROM users").fetchone() == (1, 1)
+    for word in ("محمد", "الوالدين", "رحمة"):
+        assert c.execute("SELECT DISTINCT khatma_id FROM khatma_search WHERE khatma_search MATCH ?", (f'"{normalize_arabic(word)}"',)).fetchall() == [("k1",)], word
+    c.close()
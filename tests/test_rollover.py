@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def query(db, sql, *params):
+    with db.get_connection() as conn: return conn.execute(sql, params).fetchall()
+
+
+def complete_round(db, kid=None, uid=None):
+    uid = uid or db.register_web_user("أحمد", "1", kid)[0]
+    db.assign_hizbs(uid, range(1, 61), kid)
+    assert db.mark_all_done(uid, kid) == "completed"
+    return uid
+
+
+def wait_for(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def kid(db):
+    return db.create_khatma("ختمة", None, None)[0]
+
+
+def test_rollover_archives_a_round_once(db, kid):
+    uid = complete_round(db, kid)
+    assert db.pending_rollovers() == [kid]
+
+    assert db.rollover_if_complete(kid) is True
+    assert db.rollover_if_complete(kid) is False
+
+    assert query(db, "SELECT round_no, readings, participants FROM khatma_rounds WHERE khatma_id = ?", kid) == [(1, 60, 1)]
+    assert query(db, "SELECT COUNT(*), MIN(user_id) FROM round_readings") == [(60, uid)]
+    assert db.get_khatma(kid)["total_khatmas"] == 1
+    assert db.get_board(kid).available() == list(range(1, 61))
+    assert db.pending_rollovers() == []
+
+
+def test_incomplete_round_is_left_alone(db, kid):
+    uid = db.register_web_user("أحمد", "1", kid)[0]
+    db.assign_hizbs(uid, range(1, 61), kid)
+    db.transition("done", uid, range(1, 60), kid)
+    before = db.get_v(kid)
+    assert db.rollover_if_complete(kid) is False
+    assert query(db, "SELECT COUNT(*) FROM khatma_rounds") == [(0,)]
+    assert db.get_v(kid) == before and db.get_khatma(kid)["total_khatmas"] == 0
+
+
+def test_concurrent_rollovers_archive_once(db, kid):
+    complete_round(db, kid)
+    start, results = threading.Barrier(4), []
+
+    def roll():
+        start.wait()
+        results.append(db.rollover_if_complete(kid))
+    threads = [threading.Thread(target=roll) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert sorted(results) == [False, False, False, True]
+    assert query(db, "SELECT COUNT(*) FROM khatma_rounds") == [(1,)]
+    assert db.get_khatma(kid)["total_khatmas"] == 1
+
+
+def test_global_rollover_is_idempotent(db):
+    db.register_user(42, "Bot user", "bot")
+    complete_round(db, None, 42)
+    assert db.rollover_if_complete(None) and not db.rollover_if_complete(None)
+    assert query(db, "SELECT khatma_id, round_no, readings FROM khatma_rounds") == [(None, 1, 60)]
+    assert query(db, "SELECT COUNT(*) FROM users WHERE khatma_id IS NULL") == [(0,)]
+
+
+def test_worker_skips_duplicate_submissions(db, kid):
+    worker = app.RolloverWorker(db.rollover_if_complete)
+    db.completion_listeners.append(worker.submit)
+    complete_round(db, kid)
+    worker.submit(kid)  # A double tap
+    wait_for(lambda: worker.done + worker.skipped == 2)
+    assert (worker.done, worker.skipped) == (1, 1)
+    assert query(db, "SELECT COUNT(*) FROM khatma_rounds") == [(1,)]
+
+
+def test_worker_recovers_rounds_left_complete(db, kid):
+    complete_round(db, kid)  # No worker listening, as if it died before the rollover
+    worker = app.RolloverWorker(db.rollover_if_complete, db.pending_rollovers)
+    worker.start()
+    wait_for(lambda: worker.done == 1)
+    assert db.pending_rollovers() == []
+
+
+def test_worker_retries_a_failed_rollover(db, kid, monkeypatch):
+    monkeypatch.setattr(app, "ROLLOVER_RETRY", 0.01)
+    calls = []
+
+    def flaky(k):
+        calls.append(k)
+        if len(calls) == 1: raise RuntimeError("database is locked")
+        return db.rollover_if_complete(k)
+    worker = app.RolloverWorker(flaky)
+    complete_round(db, kid)
+    worker.submit(kid)
+    wait_for(lambda: worker.done == 1)
+    assert calls == [kid, kid] and worker.failures == {}
+    assert query(db, "SELECT COUNT(*) FROM khatma_rounds") == [(1,)]
@@ -0,0 +1,130 @@
+import threading
+
+import pytest
+
+import app
+
+KINDS = app.DatabaseManager.TRANSITIONS
+
+
+@pytest.fixture
+def khatma(db):
+    kid, _ = db.create_khatma("ختمة", None, None)
+    a, _ = db.register_web_user("أحمد", "1", kid)
+    b, _ = db.register_web_user("فاطمة", "2", kid)
+    return kid, a, b
+
+
+def query(db, sql, *params):
+    with db.get_connection() as conn: return conn.execute(sql, params).fetchall()
+
+
+def state(db, kid, h):
+    """(state, owner) of hizb h."""
+    board = {(s, n): uid for s, n, uid in query(
+        db, """SELECT 'active', hizb_number, user_id FROM hizb_assignments WHERE khatma_id = ?
+               UNION ALL SELECT 'completed', hizb_number, user_id FROM completed_hizb WHERE khatma_id = ?""", kid, kid)}
+    for s in ("active", "completed"):
+        if (s, h) in board: return s, board[(s, h)]
+    return "available", None
+
+
+def put(db, kid, uid, h, s):
+    if s in ("active", "completed"): assert db.assign_hizb(uid, h, kid)
+    if s == "completed": assert db.mark_done(uid, h, kid)
+
+
+def events(db, kid):
+    return query(db, "SELECT kind, user_id, user_name, hizb, prev_version, version FROM activity_events WHERE khatma_id = ? ORDER BY id", kid)
+
+
+@pytest.mark.parametrize("kind", KINDS)
+@pytest.mark.parametrize("start, mine", [("available", True), ("active", True), ("active", False),
+                                         ("completed", True), ("completed", False)])
+def test_transition_matrix(db, khatma, kind, start, mine):
+    kid, a, b = khatma
+    put(db, kid, a if mine else b, 7, start)
+    before, n_events = db.get_v(kid), len(events(db, kid))
+
+    applied, rejected, completed = db.transition(kind, a, [7], kid)
+
+    src, dst = KINDS[kind]
+    legal = start == src and (mine or src == "available")
+    assert (applied, rejected, completed) == (([7], [], False) if legal else ([], [7], False))
+    if legal:
+        assert state(db, kid, 7) == (dst, None if dst == "available" else a)
+        assert db.get_v(kid) > before
+        assert events(db, kid)[n_events:][0][:4] == (kind, a, "أحمد", 7)
+    else:
+        assert state(db, kid, 7) == (start, None if start == "available" else (a if mine else b))
+        assert db.get_v(kid) == before and len(events(db, kid)) == n_events
+
+
+@pytest.mark.parametrize("kind", KINDS)
+def test_out_of_range_hizbs_are_rejected(db, khatma, kind):
+    kid, a, _ = khatma
+    before = db.get_v(kid)
+    assert db.transition(kind, a, [0, 61, -3], kid) == ([], [0, 61, -3], False)
+    assert db.get_v(kid) == before
+
+
+def test_batch_applies_the_legal_part(db, khatma):
+    kid, a, b = khatma
+    put(db, kid, b, 2, "active")
+    assert db.transition("assign", a, [1, 2, 3, 99], kid) == ([1, 3], [2, 99], False)
+    assert state(db, kid, 2) == ("active", b)
+
+
+def test_concurrent_double_assign_has_one_winner(db, khatma):
+    kid, a, _ = khatma
+    uids = [a] + [db.register_web_user(f"قارئ {i}", "1", kid)[0] for i in range(7)]
+    start, results = threading.Barrier(len(uids)), {}
+
+    def book(uid):
+        start.wait()
+        results[uid] = db.assign_hizb(uid, 12, kid)
+    threads = [threading.Thread(target=book, args=(uid,)) for uid in uids]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    winners = [uid for uid, ok in results.items() if ok]
+    assert len(results) == len(uids) and len(winners) == 1
+    assert state(db, kid, 12) == ("active", winners[0])
+    assert [e[:2] for e in events(db, kid)] == [("assign", winners[0])]
+    assert query(db, "SELECT active_count FROM khatmas WHERE id = ?", kid) == [(1,)]
+
+
+def test_one_commit_bumps_version_and_logs_each_hizb(db, khatma):
+    kid, a, _ = khatma
+    seen = []
+    db.listeners.append(lambda k, v: seen.append((k, v)))
+    before = db.get_v(kid)
+
+    db.transition("assign", a, [5, 4], kid)
+
+    after = db.get_v(kid)
+    assert after > before and seen == [(kid, after)]
+    assert events(db, kid) == [("assign", a, "أحمد", 4, before, after), ("assign", a, "أحمد", 5, before, after)]
+    assert [(c["kind"], c["hizb"]) for c in db.get_changes(kid, before)] == [("assign", 4), ("assign", 5)]
+
+
+def test_completing_the_round_calls_completion_listeners(db, khatma):
+    kid, a, _ = khatma
+    done = []
+    db.completion_listeners.append(done.append)
+    db.assign_hizbs(a, range(1, 61), kid)
+    assert db.transition("done", a, range(1, 60), kid)[2] is False and done == []
+    assert db.mark_done(a, 60, kid) == "completed" and done == [kid]
+
+
+def test_undo_after_rollover_is_rejected(db, khatma):
+    kid, a, _ = khatma
+    db.assign_hizbs(a, range(1, 61), kid)
+    db.mark_all_done(a, kid)
+    assert db.rollover_if_complete(kid)
+    before = db.get_v(kid)
+
+    assert db.undo_completion(a, 60, kid) is False
+    assert state(db, kid, 60) == ("available", None)
+    assert db.get_v(kid) == before
+    assert db.get_khatma(kid)["total_khatmas"] == 1